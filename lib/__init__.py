@@ -13,8 +13,11 @@
 #   limitations under the License.
 # 
 
+import re
 import urlparse
 
+HOST_RE = re.compile('[^/:]*')
+
 def reversehost(url):
 # reverse netlocation http://www.example.com/foo -> com.example.www/foo:http
   url = urlparse.urlsplit(str(url))
@@ -38,3 +41,21 @@ def reversehost(url):
     ':' + url.scheme
   )
 
+def keyhost(key):
+  """
+  Split a key produced by reversehost() into its reversed host and the
+  character that ends the host, either '/' (start of the path) or ':'
+  (port or scheme). The character is '' if the key is nothing but a host.
+
+  com.example.www/foo:http -> ('com.example.www', '/')
+  """
+  end = HOST_RE.match(key).end()
+  return key[:end], key[end:end+1]
+
+def domain_prefixes(domain):
+  """
+  Returns the prefixes, in key order, of the keys for the reversed domain
+  and all of its subdomains. Unlike using the domain itself as a prefix
+  com.example does not match com.examplefoo.
+  """
+  return (domain + '.', domain + '/', domain + ':')
@@ -0,0 +1,133 @@
+# Copyright [2012] [Triv.io, Scott Robertson]
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+"""
+Recommends index and data block sizes for a query workload.
+
+The items of an existing index are rewritten with every candidate pair of
+block sizes and the queries replayed against each copy, counting the
+requests and bytes a remote reader without a cache would fetch. The cost
+of a lookup is estimated as
+
+  requests * latency + bytes / bandwidth
+"""
+
+import mmap
+from itertools import product
+from tempfile import TemporaryFile
+
+from .pbtree import PBTreeWriter, PBTreeReader, MB, OFFSET_SIZE
+
+SIZES = (4*1024, 16*1024, 64*1024, 256*1024, MB)
+
+
+class CountingMap(object):
+  """
+  Wraps a mmap like object, counting the reads made through it and the
+  bytes they returned.
+  """
+
+  def __init__(self, source):
+    self.source = source
+    self.requests = 0
+    self.bytes = 0
+
+  def __getitem__(self, i):
+    data = self.source[i]
+    self.requests += 1
+    self.bytes += len(data)
+    return data
+
+
+class RawWriter(PBTreeWriter):
+  """
+  Writes the already packed values returned by PBTreeReader.rawitemsiter()
+  """
+
+  def pack_value(self, value):
+    return value
+
+
+def measure(source, queries, block_size, data_block_size):
+  """
+  Copies the items of the source reader to a pbtree with the given block
+  sizes and returns the number of index levels, file size and the mean
+  requests and bytes per query. Queries are prefixes, every item starting
+  with the prefix is read.
+  """
+  stream = TemporaryFile()
+  writer = RawWriter(stream, block_size=block_size, data_block_size=data_block_size, value_format=source.value_format)
+  for key, value in source.rawitemsiter(''):
+    writer.add(key, value)
+  writer.commit()
+  stream.flush()
+
+  data = mmap.mmap(stream.fileno(), 0)
+  counter = CountingMap(data)
+  reader = PBTreeReader(counter, value_format=source.value_format)
+  levels = reader.count_levels()
+
+  # the header is read once when the index is opened, not per lookup
+  counter.requests = counter.bytes = 0
+  for prefix in queries:
+    for key in reader.keyiter(prefix):
+      pass
+
+  result = dict(
+    block_size=block_size,
+    data_block_size=data_block_size,
+    levels=levels,
+    size=len(data),
+    requests=counter.requests / float(len(queries)),
+    bytes=counter.bytes / float(len(queries))
+  )
+  data.close()
+  stream.close()
+  return result
+
+
+def advise(source, queries, sizes=SIZES, latency=0.05, bandwidth=20*MB):
+  """
+  Measures every pair of index and data block sizes taken from sizes and
+  returns the results ordered by the estimated seconds per lookup, the
+  recommended sizes first. latency is the seconds each request takes and
+  bandwidth the bytes per second transferred.
+
+  Sizes too small to hold the longest item are skipped. Raises ValueError
+  when there are no queries or items, or none of the sizes can be used.
+  """
+  if not queries:
+    raise ValueError("no queries to replay")
+
+  longest = 0
+  for key in source.keyiter(''):
+    longest = max(longest, len(key) + 1)
+  if not longest:
+    raise ValueError("the index holds no items")
+
+  # an index entry is at most a key and a pointer, after the block's first pointer
+  index_sizes = [s for s in sizes if s >= longest + 2*OFFSET_SIZE]
+  data_sizes = [s for s in sizes if s >= longest + source.value_size]
+  if not index_sizes or not data_sizes:
+    raise ValueError("none of the sizes can hold the longest item, %d bytes" % (longest + max(2*OFFSET_SIZE, source.value_size)))
+
+  results = []
+  for block_size, data_block_size in product(index_sizes, data_sizes):
+    result = measure(source, queries, block_size, data_block_size)
+    result['cost'] = result['requests'] * latency + result['bytes'] / float(bandwidth)
+    results.append(result)
+
+  results.sort(key=lambda result: result['cost'])
+  return results
@@ -0,0 +1,148 @@
+# Copyright [2012] [Triv.io, Scott Robertson]
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+import mmap
+import os
+import zlib
+from itertools import groupby
+from multiprocessing import Pool
+
+MB = 1024**2
+
+# layout of the ARC files relative to the root of a local copy of
+# s3://aws-publicdatasets/common-crawl/parse-output/segment/
+ARC_KEYSTEM = '{arcSourceSegmentId}/{arcFileDate}_{arcFilePartition}.arc.gz'
+
+# gzip members are decoded by zlib when told to expect a gzip header
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+def arc_file(value):
+  """
+  Returns the path of the ARC file holding the record a location pointer
+  refers to, the distinct function of url index block summaries
+  """
+  return ARC_KEYSTEM.format(**value)
+
+def compressed_size(value):
+  """
+  The size function of url index block summaries
+  """
+  return value['compressedSize']
+
+
+def extract(hits, root, keystem=ARC_KEYSTEM, processes=None, batch_size=256):
+  """
+  Given (url, location pointer) pairs, as returned by
+  PBTreeDictReader.itemsiter(), yields (url, location pointer, record) for
+  each hit, where record is the uncompressed ARC record read from the local
+  ARC files under root. record is None when the ARC file does not exist,
+  is empty or the record can't be decompressed, so one bad file or record
+  doesn't end the extraction.
+
+  Hits are read back ordered by ARC file and offset so that each file is
+  read sequentially, not in the order they were given. Batches of at most
+  batch_size records are decompressed by a pool of processes.
+  """
+
+  def path(hit):
+    return os.path.join(root, keystem.format(**hit[1]))
+
+  hits = sorted(hits, key=lambda hit: (path(hit), hit[1]['arcFileOffset']))
+
+  pool = Pool(processes)
+  try:
+    for batch, records in pool.imap(extract_batch, batches(hits, path, batch_size)):
+      for hit, record in zip(batch, records):
+        yield hit[0], hit[1], record
+  finally:
+    pool.terminate()
+    pool.join()
+
+
+def batches(hits, path, batch_size):
+  """
+  Groups sorted hits into (path, hits) batches that never span ARC files.
+  """
+  for arc_path, file_hits in groupby(hits, path):
+    batch = []
+    for hit in file_hits:
+      batch.append(hit)
+      if len(batch) == batch_size:
+        yield arc_path, batch
+        batch = []
+    if batch:
+      yield arc_path, batch
+
+
+def extract_batch(task):
+  """
+  Runs in the worker processes, returns the batch along with the
+  uncompressed record for each hit in it.
+  """
+  arc_path, batch = task
+
+  try:
+    stream = open(arc_path, 'rb')
+  except IOError:
+    return batch, [None] * len(batch)
+
+  with stream:
+    try:
+      data = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+    except ValueError:
+      # empty files can't be mapped
+      return batch, [None] * len(batch)
+
+    try:
+      records = []
+      for url, info in batch:
+        start = info['arcFileOffset']
+        end = start + info['compressedSize']
+        try:
+          records.append(zlib.decompress(data[start:end], GZIP_WBITS))
+        except zlib.error:
+          # corrupt, or truncated by the end of the file
+          records.append(None)
+      return batch, records
+    finally:
+      data.close()
+
+
+def write_shards(records, directory, shard_size=64*MB, name='part-%05d.arc'):
+  """
+  Writes the records yielded by extract() into files in the given
+  directory, starting a new file whenever the current one exceeds
+  shard_size bytes. Returns the paths of the files written.
+  """
+  paths = []
+  stream = None
+
+  for url, info, record in records:
+    if record is None:
+      continue
+
+    if stream is None or stream.tell() >= shard_size:
+      if stream is not None:
+        stream.close()
+      paths.append(os.path.join(directory, name % len(paths)))
+      stream = open(paths[-1], 'wb')
+
+    stream.write(record)
+
+  if stream is not None:
+    stream.close()
+
+  return paths
@@ -0,0 +1,238 @@
+# Copyright [2012] [Triv.io, Scott Robertson]
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+import errno
+import fcntl
+import hashlib
+import mmap
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+MB = 1024**2
+
+TEMP_PREFIX = '.tmp-'
+LOCK_NAME = '.lock'
+SIZE_NAME = '.size'
+
+
+class BlockCache(object):
+  """
+  Persistent cache of the blocks fetched from remote indexes, stored as one
+  file per block in a local directory.
+
+  Several processes may share the same directory. Blocks are written to a
+  temporary file and renamed into place so readers never see a partial
+  block, and blocks are returned as read only mmaps which remain valid
+  even if another process evicts the block.
+
+  Once the directory grows past max_size the least recently used blocks,
+  by modification time which is updated on every hit, are deleted. The
+  size of the directory is kept in a file updated under a lock by every
+  process that writes to it, so the cap holds for all of them together.
+  Each new BlockCache measures the directory again, correcting the count
+  for writes from processes that died before recording them.
+  """
+
+  def __init__(self, directory, max_size=1024*MB):
+    self.directory = directory
+    self.max_size = max_size
+
+    try:
+      os.makedirs(directory)
+    except OSError, e:
+      if e.errno != errno.EEXIST:
+        raise
+
+    with self.lock():
+      self.write_size(sum(size for path, size, mtime in self.entries()))
+
+  @property
+  def size(self):
+    """
+    Bytes held by the directory, as last recorded by any process
+    """
+    try:
+      with open(os.path.join(self.directory, SIZE_NAME)) as stream:
+        return int(stream.read() or 0)
+    except IOError:
+      return 0
+
+  def write_size(self, size):
+    with open(os.path.join(self.directory, SIZE_NAME), 'w') as stream:
+      stream.write(str(size))
+
+  def lock(self):
+    """
+    Returns the directory's lock file, locked until it is closed
+    """
+    lock = open(os.path.join(self.directory, LOCK_NAME), 'a')
+    fcntl.flock(lock, fcntl.LOCK_EX)
+    return lock
+
+  def path(self, identity, start, end):
+    name = hashlib.sha1(identity).hexdigest()
+    return os.path.join(self.directory, name[:2], '%s-%d-%d' % (name, start, end))
+
+  def get(self, identity, start, end):
+    """
+    Returns the cached bytes for the given range of the identified object,
+    or None if they have not been cached.
+    """
+    path = self.path(identity, start, end)
+    try:
+      stream = open(path, 'rb')
+    except IOError:
+      return None
+
+    with stream:
+      size = os.fstat(stream.fileno()).st_size
+      if size == 0:
+        return ''
+      data = mmap.mmap(stream.fileno(), size, access=mmap.ACCESS_READ)
+
+    try:
+      os.utime(path, None)
+    except OSError:
+      # evicted by another process since being opened
+      pass
+
+    return data
+
+  def put(self, identity, start, end, data):
+    path = self.path(identity, start, end)
+    directory = os.path.dirname(path)
+
+    try:
+      os.mkdir(directory)
+    except OSError, e:
+      if e.errno != errno.EEXIST:
+        raise
+
+    fd, temp = tempfile.mkstemp(prefix=TEMP_PREFIX, dir=directory)
+    try:
+      with os.fdopen(fd, 'wb') as stream:
+        stream.write(data)
+
+      with self.lock():
+        try:
+          # another process may have cached the same block
+          replaced = os.stat(path).st_size
+        except OSError:
+          replaced = 0
+        os.rename(temp, path)
+
+        size = self.size + len(data) - replaced
+        if size > self.max_size:
+          size = self.evict()
+        self.write_size(size)
+    except:
+      if os.path.exists(temp):
+        os.unlink(temp)
+      raise
+
+  def entries(self):
+    """
+    Yields (path, size, modification time) for every cached block
+    """
+    for directory, dirs, files in os.walk(self.directory):
+      for name in files:
+        if name.startswith(TEMP_PREFIX) or name in (LOCK_NAME, SIZE_NAME):
+          continue
+        path = os.path.join(directory, name)
+        try:
+          stat = os.stat(path)
+        except OSError:
+          continue
+        yield path, stat.st_size, stat.st_mtime
+
+  def evict(self):
+    """
+    Deletes the least recently used blocks until the cache is at 90% of
+    max_size, returns the size left. Must be called holding the lock.
+    """
+    entries = sorted(self.entries(), key=lambda entry: entry[2])
+    size = sum(entry[1] for entry in entries)
+    target = self.max_size * 0.9
+
+    for path, entry_size, mtime in entries:
+      if size <= target:
+        break
+      try:
+        os.unlink(path)
+      except OSError:
+        pass
+      size -= entry_size
+
+    return size
+
+
+class MemoryCache(object):
+  """
+  In memory counterpart of BlockCache for long running processes, holds up
+  to max_size bytes of blocks evicting the least recently used first. Safe
+  to share between threads.
+  """
+
+  def __init__(self, max_size=256*MB):
+    self.max_size = max_size
+    self.size = 0
+    self.blocks = OrderedDict()
+    self.lock = threading.Lock()
+
+  def get(self, identity, start, end):
+    with self.lock:
+      data = self.blocks.pop((identity, start, end), None)
+      if data is not None:
+        self.blocks[identity, start, end] = data
+      return data
+
+  def put(self, identity, start, end, data):
+    with self.lock:
+      if (identity, start, end) in self.blocks:
+        return
+      self.blocks[identity, start, end] = data
+      self.size += len(data)
+      while self.size > self.max_size:
+        key, evicted = self.blocks.popitem(last=False)
+        self.size -= len(evicted)
+
+
+class CachedMap(object):
+  """
+  Wraps a mmap like object, such as the BotoMap used to read remote
+  indexes, so that every slice read through it is stored in a BlockCache
+  or MemoryCache.
+
+  identity must change whenever the underlying object does, for S3 the key
+  name plus its ETag or size works well.
+  """
+
+  def __init__(self, source, cache, identity):
+    self.source = source
+    self.cache = cache
+    self.identity = identity
+
+  def __getitem__(self, i):
+    if not isinstance(i, slice):
+      return self[i:i+1]
+
+    data = self.cache.get(self.identity, i.start, i.stop)
+    if data is None:
+      data = self.source[i]
+      if data:
+        self.cache.put(self.identity, i.start, i.stop, data)
+    return data
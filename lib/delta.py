@@ -0,0 +1,129 @@
+# Copyright [2012] [Triv.io, Scott Robertson]
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+import heapq
+from itertools import groupby
+
+from .pbtree import PBTreeWriter, PBTreeReader
+
+# tombstones are stored in a pbtree of their own, the value is unused
+TOMBSTONE_FORMAT = '<B'
+
+# sorts before ITEM so a key deleted and added in the same delta is deleted
+TOMBSTONE = 0
+ITEM = 1
+
+
+class DeltaWriter(object):
+  """
+  Records the changes to a base pbtree as two small pbtrees, one of the
+  items that were added or replaced and one of the keys that were deleted.
+  As with any pbtree, keys must be added (and deleted) in sorted order.
+  """
+
+  def __init__(self, items, tombstones, block_size=None):
+    """
+    items is a PBTreeWriter for the same kind of values as the base,
+    tombstones the stream the deleted keys are written to with the given
+    block_size, by default that of items.
+    """
+    self.items = items
+    self.tombstones = PBTreeWriter(
+      tombstones,
+      block_size=block_size or items.block_size,
+      value_format=TOMBSTONE_FORMAT
+    )
+
+  def add(self, key, value):
+    self.items.add(key, value)
+
+  def delete(self, key):
+    self.tombstones.add(key, 0)
+
+  def close(self):
+    self.items.close()
+    self.tombstones.close()
+
+
+class Delta(object):
+  """
+  Reads the pbtrees written by a DeltaWriter. items is a reader for the same
+  kind of values as the base, tombstones a mmap like object.
+  """
+
+  def __init__(self, items, tombstones):
+    self.items = items
+    self.tombstones = PBTreeReader(tombstones, value_format=TOMBSTONE_FORMAT)
+
+
+class MergedReader(object):
+  """
+  Presents a base pbtree overlaid with any number of deltas, given oldest
+  first, as a single pbtree. The newest version of each key wins and deleted
+  keys are hidden.
+
+  Results are produced by merging the sorted streams of the base and each
+  delta so only one item per stream is held in memory.
+  """
+
+  def __init__(self, base, deltas=()):
+    self.base = base
+    self.deltas = list(deltas)
+
+  def streams(self, prefix):
+    # newer streams sort first for the same key
+    yield tagged(self.base.itemsiter(prefix), 0, ITEM)
+    for priority, delta in enumerate(self.deltas, 1):
+      yield tagged(delta.items.itemsiter(prefix), -priority, ITEM)
+      yield tagged(delta.tombstones.itemsiter(prefix), -priority, TOMBSTONE)
+
+  def keys(self, prefix=''):
+    return list(self.keyiter(prefix))
+
+  def keyiter(self, prefix=''):
+    for key, value in self.itemsiter(prefix):
+      yield key
+
+  def values(self, prefix=''):
+    return list(self.valueiter(prefix))
+
+  def valueiter(self, prefix=''):
+    for key, value in self.itemsiter(prefix):
+      yield value
+
+  def items(self, prefix=''):
+    return list(self.itemsiter(prefix))
+
+  def itemsiter(self, prefix=''):
+    merged = heapq.merge(*self.streams(prefix))
+    for key, versions in groupby(merged, lambda version: version[0]):
+      key, priority, kind, value = versions.next()
+      if kind == ITEM:
+        yield key, value
+
+
+def tagged(items, priority, kind):
+  for key, value in items:
+    yield key, priority, kind, value
+
+
+def compact(reader, writer):
+  """
+  Writes every item of the reader, typically a MergedReader, to the
+  writer in a single sequential pass and closes the writer.
+  """
+  for key, value in reader.itemsiter(''):
+    writer.add(key, value)
+  writer.close()
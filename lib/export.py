@@ -0,0 +1,166 @@
+# Copyright [2012] [Triv.io, Scott Robertson]
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+"""
+Exports items to columnar files that numpy can load without copying.
+
+Items are written in row groups, each a directory holding one .npy file
+per value field plus url_offsets.npy and url_bytes.npy. The urls of row i
+are url_bytes[url_offsets[i]:url_offsets[i+1]]. A manifest.json in the
+output directory lists the row groups. For example
+
+  fields = numpy.load('out/part-00000/arcFileOffset.npy', mmap_mode='r')
+"""
+
+import json
+import os
+import struct
+import sys
+from itertools import chain
+
+from .pbtree import field_layout
+
+MB = 1024**2
+
+# struct codes to numpy type kinds, the byte order is prepended and the
+# size, which depends on the format's byte order character, appended
+NPY_KINDS = {
+  'b': 'i', 'B': 'u',
+  'h': 'i', 'H': 'u',
+  'i': 'i', 'I': 'u',
+  'l': 'i', 'L': 'u',
+  'q': 'i', 'Q': 'u',
+  'f': 'f', 'd': 'f',
+}
+
+# struct byte order characters to numpy's, native when there is none
+NPY_ORDERS = {'<': '<', '>': '>', '!': '>'}
+NATIVE_ORDER = '<' if sys.byteorder == 'little' else '>'
+
+NPY_MAGIC = '\x93NUMPY\x01\x00'
+OFFSET_FORMAT = '<Q'
+
+
+def npy_header(descr, length):
+  """
+  Returns a version 1.0 .npy header for a one dimensional array
+  """
+  header = "{'descr': '%s', 'fortran_order': False, 'shape': (%d,), }" % (descr, length)
+  # the data must start on a 64 byte boundary, the header ends with a newline
+  padding = 64 - (len(NPY_MAGIC) + 2 + len(header) + 1) % 64
+  header += ' ' * (padding % 64) + '\n'
+  return NPY_MAGIC + struct.pack('<H', len(header)) + header
+
+
+class ColumnarWriter(object):
+  """
+  Writes (key, packed value) pairs, such as those returned by
+  PBTreeReader.rawitemsiter(), as columnar row groups. Values are split
+  into their fields without being unpacked.
+
+  A row group is written once it holds row_group_size rows or its urls
+  take more than row_group_bytes, so memory use is bounded regardless of
+  how many items are exported.
+  """
+
+  def __init__(self, directory, fields, value_format, row_group_size=1024*1024, row_group_bytes=256*MB):
+    self.directory = directory
+    self.fields = fields
+    self.row_group_size = row_group_size
+    self.row_group_bytes = row_group_bytes
+
+    layout = field_layout(value_format)
+    if len(layout) != len(fields):
+      raise ValueError("%d fields given for value format %r" % (len(fields), value_format))
+
+    order = NPY_ORDERS.get(value_format[0], NATIVE_ORDER)
+    self.columns = []
+    for (format, offset), name in zip(layout, fields):
+      if format[-1] not in NPY_KINDS:
+        raise ValueError("can't export field %r of struct type %r" % (name, format[-1]))
+      size = struct.calcsize(format)
+      self.columns.append(dict(
+        name=name,
+        start=offset,
+        end=offset + size,
+        descr='%s%s%d' % (order if size > 1 else '|', NPY_KINDS[format[-1]], size)
+      ))
+
+    self.row_groups = []
+    self.reset()
+
+  def reset(self):
+    self.rows = 0
+    self.url_bytes = bytearray()
+    self.url_offsets = bytearray(struct.pack(OFFSET_FORMAT, 0))
+    self.buffers = [bytearray() for column in self.columns]
+
+  def add(self, key, value):
+    self.url_bytes.extend(key)
+    self.url_offsets.extend(struct.pack(OFFSET_FORMAT, len(self.url_bytes)))
+    for column, buffer in zip(self.columns, self.buffers):
+      buffer.extend(value[column['start']:column['end']])
+
+    self.rows += 1
+    if self.rows >= self.row_group_size or len(self.url_bytes) >= self.row_group_bytes:
+      self.flush()
+
+  def flush(self):
+    if not self.rows:
+      return
+
+    name = 'part-%05d' % len(self.row_groups)
+    path = os.path.join(self.directory, name)
+    os.mkdir(path)
+
+    arrays = [
+      ('url_offsets', '<u8', self.rows + 1, self.url_offsets),
+      ('url_bytes', '|u1', len(self.url_bytes), self.url_bytes),
+    ] + [
+      (column['name'], column['descr'], self.rows, buffer)
+      for column, buffer in zip(self.columns, self.buffers)
+    ]
+
+    for array_name, descr, length, buffer in arrays:
+      with open(os.path.join(path, array_name + '.npy'), 'wb') as stream:
+        stream.write(npy_header(descr, length))
+        stream.write(buffer)
+
+    self.row_groups.append(dict(name=name, rows=self.rows))
+    self.reset()
+
+  def close(self):
+    self.flush()
+    with open(os.path.join(self.directory, 'manifest.json'), 'w') as stream:
+      json.dump(dict(
+        fields=[dict(name=c['name'], descr=c['descr']) for c in self.columns],
+        row_groups=self.row_groups
+      ), stream, indent=2)
+
+
+def export(reader, directory, prefixes=('',), **options):
+  """
+  Exports the items of the reader starting with any of the prefixes to
+  directory, which must exist. The fields are named after the reader's
+  item_keys, or 'value' for a scalar reader. Returns the row groups written.
+  """
+  fields = getattr(reader, 'item_keys', ('value',))
+  writer = ColumnarWriter(directory, fields, reader.value_format, **options)
+
+  for key, value in chain.from_iterable(reader.rawitemsiter(p) for p in prefixes):
+    writer.add(key, value)
+  writer.close()
+
+  return writer.row_groups
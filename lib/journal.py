@@ -0,0 +1,133 @@
+# Copyright [2012] [Triv.io, Scott Robertson]
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+import json
+import os
+
+MB = 1024**2
+
+
+def work_units(index_results, source, unit_size=64*MB, name='part-%05d.gz'):
+  """
+  Split index_results into consecutive units of roughly unit_size
+  compressed bytes. Returns a list of (unit, records) pairs where unit
+  describes the ARC file/offset range covered by the records and the name
+  of the object the unit is written to.
+
+  source is a callable that returns the ARC file name for a record.
+
+  Given the same index_results the same units are always produced, which
+  is what allows a journal to recognize work finished by an earlier run.
+  """
+  units = []
+  records = []
+  size = 0
+
+  def close():
+    first, last = records[0], records[-1]
+    unit = dict(
+      unit    = len(units),
+      output  = name % len(units),
+      first   = [source(first), first['arcFileOffset']],
+      last    = [source(last), last['arcFileOffset']],
+      records = len(records),
+      bytes   = size
+    )
+    units.append((unit, records))
+
+  for record in index_results:
+    records.append(record)
+    size += record['compressedSize']
+    if size >= unit_size:
+      close()
+      records = []
+      size = 0
+
+  if records:
+    close()
+
+  return units
+
+
+class JournalMismatch(ValueError):
+  pass
+
+
+class Journal(object):
+  """
+  Append only log of the work units that have been completed.
+
+  The first line of the file records the parameters of the run, every
+  following line is a completed unit as returned by work_units(). Each
+  line is flushed and synced before record() returns so that a crash
+  loses at most the unit being written.
+  """
+
+  def __init__(self, path, params):
+    self.path = path
+    self.params = params
+    self.completed = {}
+
+    # an empty journal, e.g. after a crash before the header was written,
+    # is started over
+    started = os.path.exists(path) and self.load()
+    self.stream = open(path, 'a')
+    if not started:
+      self.write(params)
+
+  def load(self):
+    """
+    Reads the units completed by earlier runs, returns False if the journal
+    has no header yet
+    """
+    with open(self.path, 'r+') as stream:
+      contents = stream.read()
+      # drop a partially written line left by an interrupted run, the unit
+      # it describes will simply be done again
+      end = contents.rfind('\n') + 1
+      stream.truncate(end)
+
+    lines = contents[:end].splitlines()
+    if not lines:
+      return False
+
+    header = json.loads(lines[0])
+    if header != self.params:
+      raise JournalMismatch(
+        "journal %s was written for %r not %r" % (self.path, header, self.params)
+      )
+
+    for line in lines[1:]:
+      unit = json.loads(line)
+      self.completed[unit['unit']] = unit
+    return True
+
+  def is_complete(self, unit):
+    """
+    Returns True if the given unit was completed by this or an earlier run.
+    """
+    return self.completed.get(unit['unit']) == unit
+
+  def record(self, unit):
+    self.write(unit)
+    self.completed[unit['unit']] = unit
+
+  def write(self, obj):
+    self.stream.write(json.dumps(obj, sort_keys=True) + '\n')
+    self.stream.flush()
+    os.fsync(self.stream.fileno())
+
+  def close(self):
+    self.stream.close()
@@ -16,13 +16,20 @@
 import bisect
 import os
 import mmap
+import random
+import re
+import sre_parse
 import struct
+from sre_constants import AT, ASSERT, ASSERT_NOT
+from sre_constants import AT_BEGINNING, AT_BEGINNING_STRING, AT_BEGINNING_LINE, AT_BOUNDARY, AT_NON_BOUNDARY
+from collections import namedtuple
 import sys
 from tempfile import TemporaryFile, SpooledTemporaryFile
 from cStringIO import StringIO
 import itertools
 
-from .prefix import signifigant
+from .prefix import signifigant, successor
+from . import keyhost, domain_prefixes
 
 MB = 1024**2
 DISK_BLOCK_SIZE=1024 * 4
@@ -30,15 +37,30 @@ DISK_BLOCK_SIZE=1024 * 4
 OFFSET_FMT = '<I'
 OFFSET_SIZE = struct.calcsize(OFFSET_FMT)
 
+# block size, number of index blocks
+HEADER_FMT = '<II'
+# written when the index and data blocks differ in size: 0 (never a valid
+# block size in the first format), version, index block size, data block
+# size, number of index blocks
+HEADER_V2_FMT = '<IIIII'
+FORMAT_VERSION = 2
+
 
 
 class PBTreeWriter(object):
   """
   Constructs a disk based prefixed btreefor a sacalr value.
+
+  If summary, a BlockSummaryWriter, is given a summary of every data block
+  is written along side the tree.
+
+  block_size is the size of the index blocks and, unless data_block_size is
+  given, of the data blocks.
   """
     
-  def __init__(self, stream, block_size=MB, terminator='\0', value_format="<Q"):
+  def __init__(self, stream, block_size=MB, terminator='\0', value_format="<Q", summary=None, data_block_size=None):
     self.stream = stream
+    self.summary = summary
     
     assert len(terminator) == 1, "terminator must be of legth 1"
     
@@ -46,11 +68,12 @@ class PBTreeWriter(object):
     self.value_size = struct.calcsize(self.value_format)
       
     self.block_size = block_size
+    self.data_block_size = data_block_size or block_size
 
     self.last_key = ''
     
-    self.data_segment  = DataWriter(TemporaryFile(), block_size, terminator, self)
-    self.index_segment = IndexWriter(stream, block_size, terminator)
+    self.data_segment  = DataWriter(TemporaryFile(), self.data_block_size, terminator, self)
+    self.index_segment = IndexWriter(stream, block_size, terminator, data_block_size=self.data_block_size)
 
   
   def pack_value(self, value):
@@ -60,11 +83,15 @@ class PBTreeWriter(object):
   def add(self, key, value):
     self.data_segment.add(key,value)
     self.last_key = key
+    if self.summary:
+      self.summary.add(key, value)
     
 
   def on_new_block(self, key):
     prefix_key = signifigant(self.last_key, key)
     self.index_segment.add(0, prefix_key)
+    if self.summary:
+      self.summary.new_block()
 
 
   def on_item_exceeds_block_size(self,key,value):
@@ -76,6 +103,9 @@ class PBTreeWriter(object):
     
     self.index_segment.finish()    
     self.data_segment.finish()
+
+    if self.summary:
+      self.summary.finish(self.index_segment.blocks_written)
     
     while True:
       bytes = self.data_segment.read(DISK_BLOCK_SIZE)
@@ -88,6 +118,8 @@ class PBTreeWriter(object):
   def close(self):
     self.commit()
     self.stream.close()
+    if self.summary:
+      self.summary.stream.close()
   
 class PBTreeSequenceWriter(PBTreeWriter):
   """
@@ -129,37 +161,63 @@ class PBTreeReader(object):
       for offset, key in IndexBlockReader(block):
         yield offset, key
     
-  def __init__(self, mmap, terminator='\0', value_format="<Q"):
+  def __init__(self, mmap, terminator='\0', value_format="<Q", index_cache=None):
+    """
+    If index_cache, a dictionary, is given the parsed index blocks are kept
+    in it, long running processes can use it to avoid re-reading the index
+    for every lookup.
+    """
     self.mmap = mmap
     #self.mmap.seek(0)
+    self.index_cache = index_cache
     self.terminator = terminator
     self.value_format = value_format
     self.value_size = struct.calcsize(self.value_format)
     
 
-    self.header_fmt = "<II"
+    self.header_fmt, self.block_size, self.data_block_size, self.index_block_size = self.fetch_header()
     self.header_size = struct.calcsize(self.header_fmt)
-    
-    self.block_size, self.index_block_size = self.fetch_header()
+    # data blocks follow the index blocks
+    self.data_offset = self.header_size + self.block_size*self.index_block_size
   
   
   def fetch(self, start, end):
     return self.mmap[start:end]
     
   def fetch_header(self):
-    return struct.unpack(self.header_fmt, self.fetch(0,self.header_size))
+    """
+    Returns the header format, index block size, data block size and number
+    of index blocks
+    """
+    header = self.fetch(0, struct.calcsize(HEADER_V2_FMT))
+    block_size, index_block_size = struct.unpack_from(HEADER_FMT, header)
+    if block_size:
+      return HEADER_FMT, block_size, block_size, index_block_size
+
+    marker, version, block_size, data_block_size, index_block_size = struct.unpack_from(HEADER_V2_FMT, header)
+    if version != FORMAT_VERSION:
+      raise ValueError("unsupported pbtree version %d" % version)
+    return HEADER_V2_FMT, block_size, data_block_size, index_block_size
           
   def block(self, block_number):
     """
     Returns the block for given block number 
     """
+    if self.index_cache is not None and block_number in self.index_cache:
+      return self.index_cache[block_number]
     
     offset = self.block_offset(block_number)
     block = self.fetch(offset, offset+self.block_size)    
-    return IndexBlockReader(block)
+    block = IndexBlockReader(block)
+
+    if self.index_cache is not None:
+      self.index_cache[block_number] = block
+    return block
     
   def block_offset(self, block_number):
-    return self.header_size + (self.block_size*block_number)
+    if block_number < self.index_block_size:
+      return self.header_size + (self.block_size*block_number)
+    return self.data_offset + self.data_block_size*(block_number - self.index_block_size)
     
   def count_levels(self):
     """Return the number of 'levels' in the index. This number represents
@@ -196,7 +254,7 @@ class PBTreeReader(object):
     
     starting_block = self.find_starting_data_block(key)
     offset = self.block_offset(starting_block)
-    data = self.fetch(offset,offset+self.block_size)
+    data = self.fetch(offset,offset+self.data_block_size)
 
     
     # linear scan through the block, looking for the position of the stored key
@@ -234,45 +292,352 @@ class PBTreeReader(object):
         # it's the start of the data segments,
         return next_block_number
     
-  def keys(self, prefix=''):
-    return list(self.keyiter(prefix))
+  def last_data_block(self):
+    """
+    Return the number of the last data block, found by following the last
+    pointer of each index block.
+    """
+    block_number = 0
+    while block_number < self.index_block_size:
+      for block_number, key in self.block(block_number):
+        pass
+    return block_number
+
+  def data_block_range(self, prefix):
+    """
+    Return the numbers of the first and last data blocks that could contain
+    keys starting with prefix. Every block between the two only contains
+    keys starting with prefix.
+    """
+    first = self.find_starting_data_block(prefix)
+    end = successor(prefix)
+    if end is None:
+      return first, self.last_data_block()
+    return first, self.find_starting_data_block(end)
+
+  def get(self, key, default=None):
+    """
+    Returns the value stored for key, or default if there is none
+    """
+    for stored, value in self.itemsiter(key):
+      if stored == key:
+        return value
+      break
+    return default
+
+  def keys(self, prefix='', key_filter=None, value_filter=None):
+    return list(self.keyiter(prefix, key_filter, value_filter))
 
-  def keyiter(self, prefix=''):
-    for key, value in self.itemsiter(prefix):
-      if key.startswith(prefix):
-        yield key
+  def keyiter(self, prefix='', key_filter=None, value_filter=None):
+    # keys only, the value bytes are never copied
+    for block, start, end in self.select(prefix, key_filter, value_filter):
+      yield block[start:end]
 
   def values(self, prefix=''):
     return list(self.valueiter(prefix))
     
   def valueiter(self, prefix=''):
-    for key, value in self.itemsiter(prefix):
-      if key.startswith(prefix):
-        yield value
+    value_size = self.value_size
+    parse_value = self.parse_value
+    for block, start, end in self.scan(prefix):
+      yield parse_value(block[end+1:end+1+value_size])
       
 
-  def items(self, prefix=''):
-    return list(self.itemsiter(prefix))
+  def items(self, prefix='', key_filter=None, value_filter=None):
+    return list(self.itemsiter(prefix, key_filter, value_filter))
+
+  def itemsiter(self, prefix, key_filter=None, value_filter=None):
+    """
+    Yields (key, value) for every key starting with prefix, see select()
+    for the filters.
+    """
+    value_size = self.value_size
+    parse_value = self.parse_value
+    for block, start, end in self.select(prefix, key_filter, value_filter):
+      yield block[start:end], parse_value(block[end+1:end+1+value_size])
+
+  def rawitemsiter(self, prefix='', key_filter=None, value_filter=None):
+    """
+    Like itemsiter() but yields the packed bytes of each value unparsed
+    """
+    value_size = self.value_size
+    for block, start, end in self.select(prefix, key_filter, value_filter):
+      yield block[start:end], block[end+1:end+1+value_size]
+
+  def select(self, prefix, key_filter=None, value_filter=None):
+    """
+    Like scan() but only yields the items passing both filters. The filters
+    are tested against the bytes of the block, so nothing is copied for
+    the items they reject.
+
+    key_filter is either
+      a string                      the key must contain it, blocks that
+                                    don't contain it are skipped whole
+      a compiled regular expression searched for within the key, see
+                                    key_pattern()
+      a function                    called with the key
+
+    value_filter is either a dictionary of fields to the value the field
+    must have, a set of the values it may have or a function called with
+    the field's value, or a function called with the parsed value. Fields
+    are named as in value_fields().
+    """
+    tests = []
+    block_filter = None
+    pattern = None
+
+    if key_filter is None:
+      pass
+    elif isinstance(key_filter, basestring):
+      block_filter = key_filter
+      tests.append(lambda block, start, end: block.find(key_filter, start, end) != -1)
+    elif hasattr(key_filter, 'search'):
+      pattern = key_pattern(key_filter)
+    else:
+      tests.append(lambda block, start, end: key_filter(block[start:end]))
+
+    if value_filter is None:
+      pass
+    elif callable(value_filter):
+      value_size = self.value_size
+      parse_value = self.parse_value
+      tests.append(lambda block, start, end: value_filter(parse_value(block[end+1:end+1+value_size])))
+    else:
+      fields = self.value_fields()
+      for name, expected in value_filter.items():
+        if name not in fields:
+          raise ValueError("unknown value field %r" % (name,))
+        format, offset = fields[name]
+        tests.append(field_test(format, offset + len(self.terminator), expected))
+
+    if pattern is not None:
+      # the slowest test, run once the others have passed
+      tests.append(pattern)
+
+    for block, start, end in self.scan(prefix, block_filter):
+      for test in tests:
+        if not test(block, start, end):
+          break
+      else:
+        yield block, start, end
+
+  def value_fields(self):
+    """
+    Returns a dictionary of each field of the value, by position, to its
+    (format, offset) within the packed value
+    """
+    return dict(enumerate(field_layout(self.value_format)))
+
+  def scan(self, prefix, block_filter=None):
+    """
+    Yields (block, start, end) for every key starting with prefix, where
+    block[start:end] is the key and its value follows the terminator at
+    end. Nothing is copied out of the blocks, it is up to the caller to
+    slice out what it needs.
 
-  def itemsiter(self, prefix):
+    If block_filter is given, blocks not containing it are skipped.
+    """
     starting_block = self.find_starting_data_block(prefix)
-    blocks = self.blockiter(starting_block)
+    first = True
+
+    for block in self.blockiter(starting_block):
+      if not isinstance(block, str):
+        # mmap like blocks (e.g. from a BlockCache) lack startswith
+        block = block[:]
+
+      if block_filter is not None and block_filter not in block:
+        # no key here can match, but the prefix ends in this block if its
+        # last key sorts after the prefix
+        last = None
+        for last in DataBlockReader(block, self.value_size, self.terminator).positions():
+          pass
+        if last is None:
+          return
+        start, end = last
+        if not block.startswith(prefix, start, end) and block[start:end] > prefix:
+          return
+        first = False
+        continue
+
+      startswith = block.startswith
+      for start, end in DataBlockReader(block, self.value_size, self.terminator).positions():
+        if startswith(prefix, start, end):
+          first = False
+          yield block, start, end
+        elif not first:
+          return
+        # otherwise skip over keys before the prefix in the first block
+
+      first = False
+    
+    
+  def sample(self, prefix, n, seed=None, block_weight=None):
+    """
+    Returns a uniform random sample of n items starting with prefix, in key
+    order, or every such item if there are fewer than n.
+
+    Blocks spanned by the prefix are picked at random and then an item
+    within the block, items that don't start with prefix are rejected. If
+    given, block_weight(block_number) returns the number of items in a
+    block and blocks are picked in proportion to it, otherwise every block
+    is assumed to hold about the same number of items. Blocks it returns
+    None for are assumed to hold the mean of the others. The number of
+    blocks read is proportional to n rather than to the number of items
+    under prefix, so when rejection fails to find n items in a range too
+    large to read in full fewer than n are returned.
+    """
+    rng = random.Random(seed)
+    first, last = self.data_block_range(prefix)
+    blocks = range(first, last + 1)
+
+    weights = None
+    if block_weight:
+      weights = [block_weight(b) for b in blocks]
+      known = [w for w in weights if w is not None]
+      if any(w < 0 for w in known):
+        raise ValueError("block weights must not be negative")
+      mean = sum(known) / float(len(known)) if known else 1
+      weights = [mean if w is None else w for w in weights]
+      if not sum(weights):
+        # no information about the blocks, treat them all alike
+        weights = None
+
+    if weights:
+      totals = []
+      total = 0
+      for w in weights:
+        total += w
+        totals.append(total)
+      pick = lambda: blocks[bisect.bisect(totals, rng.random() * total)]
+    else:
+      total = len(blocks)
+      pick = lambda: rng.choice(blocks)
+
+    decoded = {}
+    chosen = set()
+    attempts = 4 * n + 100
+
+    while total and len(chosen) < n and attempts and len(decoded) < len(blocks):
+      attempts -= 1
+      block_number = pick()
+      if block_number not in decoded:
+        decoded[block_number] = list(
+          DataBlockReader(self.data_block(block_number), self.value_size, self.terminator)
+        )
+      items = decoded[block_number]
+      if not items:
+        continue
+      pos = rng.randrange(len(items))
+      if items[pos][0].startswith(prefix):
+        chosen.add((block_number, pos))
+
+    if len(chosen) < n and len(decoded) == len(blocks):
+      # every block of the range was read, sample from its items directly
+      matching = [
+        (b, pos)
+        for b in blocks
+        for pos, item in enumerate(decoded[b])
+        if item[0].startswith(prefix)
+      ]
+      chosen = rng.sample(matching, min(n, len(matching)))
+
+    return [
+      (decoded[b][pos][0], self.parse_value(decoded[b][pos][1]))
+      for b, pos in sorted(chosen)
+    ]
+
+  def domain_items(self, domain):
+    return list(self.domain_itemsiter(domain))
+
+  def domain_itemsiter(self, domain):
+    """
+    Iterate over the items for the given reversed domain and its subdomains.
+    Unlike itemsiter('com.example') this will not return items for hosts such
+    as com.examplefoo
+    """
+    for prefix in domain_prefixes(domain):
+      for key, value in self.itemsiter(prefix):
+        yield key, value
+
+  def hosts(self, prefix=''):
+    return list(self.hostiter(prefix))
+
+  def hostiter(self, prefix=''):
+    """
+    Iterate over the distinct reversed hosts of the keys starting with prefix.
+
+    Once a host has been seen the scan seeks directly to the first key
+    following that host's urls, so the cost is roughly one seek per host
+    rather than one item per url.
+    """
+
+    # Keys for a host live in [host + '/', host + ';') but keys for hosts
+    # such as host + '1' sort between host + '/...' and host + ':...'. Hosts
+    # stay 'open' until the scan passes their range so they're only
+    # reported once.
+    open_hosts = []
+    target = prefix
+    block_number = self.find_starting_data_block(prefix)
 
-    # skip over keys in the first block
-    first_block = blocks.next()
-    for key,value in itertools.dropwhile(lambda (k,v): not k.startswith(prefix), self.dataiter(first_block)):
-      if not key.startswith(prefix):
+    while True:
+      block = self.data_block(block_number)
+      if not block:
         return
-      yield key,value
 
-    for block in blocks:
-      for key,value in self.dataiter(block):
+      keys = list(DataBlockReader(block, self.value_size, self.terminator).keys())
+      pos = bisect.bisect_left(keys, target)
+
+      while pos < len(keys):
+        key = keys[pos]
         if not key.startswith(prefix):
           return
+
+        host, sep = keyhost(key)
+        open_hosts = [h for h in open_hosts if key < h + ';']
+        if host not in open_hosts:
+          open_hosts.append(host)
+          yield host
+
+        # skip the rest of this host's urls in the current range
+        if sep:
+          target = host + chr(ord(sep) + 1)
         else:
-          yield key,value
-    
-    
+          target = key + '\0'
+        if not target.startswith(prefix):
+          # past every key starting with prefix
+          return
+        pos = bisect.bisect_left(keys, target, pos + 1)
+
+      block_number = max(block_number + 1, self.find_starting_data_block(target))
+
+  def domain_hosts(self, domain):
+    return list(self.domain_hostiter(domain))
+
+  def domain_hostiter(self, domain):
+    """
+    Iterate over the distinct hosts of the given reversed domain and its
+    subdomains.
+    """
+    seen_domain = False
+    for prefix in domain_prefixes(domain):
+      for host in self.hostiter(prefix):
+        if host == domain:
+          if seen_domain:
+            continue
+          seen_domain = True
+        yield host
+
+  def host_histogram(self, prefix=''):
+    """
+    Returns a dictionary of the number of urls for each host of the keys
+    starting with prefix.
+    """
+    histogram = {}
+    for key in self.keyiter(prefix):
+      host = keyhost(key)[0]
+      histogram[host] = histogram.get(host, 0) + 1
+    return histogram
+
   def parse_value(self, bytes):
     """
     Returns a scalar
@@ -289,25 +654,126 @@ class PBTreeReader(object):
     """
 
     while True:
-      offset = self.block_offset(block_number)
-      block = self.mmap[offset:offset+self.block_size]
+      block = self.data_block(block_number)
       if block:
         yield block
         block_number += 1
       else:
         break
         
+  def data_block(self, block_number):
+    """
+    Returns the raw bytes of the given data block, or an empty string past
+    the end of the file
+    """
+    offset = self.block_offset(block_number)
+    return self.fetch(offset, offset+self.data_block_size)
+
   def dataiter(self, block):    
     for key, value in DataBlockReader(block, self.value_size, self.terminator):
       yield key, self.parse_value(value)
 
 
+def field_test(format, offset, expected):
+  """
+  Returns a test of whether the field packed with format at offset past
+  the end of a key holds the expected value, one of a set of values or
+  passes the given function
+  """
+  if callable(expected):
+    unpack_from = struct.Struct(format).unpack_from
+    return lambda block, start, end: expected(unpack_from(block, end+offset)[0])
+
+  # compare the packed bytes rather than unpacking every value
+  if isinstance(expected, (set, frozenset, list, tuple)):
+    packed = tuple(struct.pack(format, value) for value in expected)
+  else:
+    packed = struct.pack(format, expected)
+  return lambda block, start, end: block.startswith(packed, end+offset)
+
+
+# assertions that look at the characters before the position a search
+# starts from, which are past the start of the key when searching a block
+LOOK_BEHIND = (AT_BEGINNING, AT_BEGINNING_STRING, AT_BEGINNING_LINE, AT_BOUNDARY, AT_NON_BOUNDARY)
+
+def looks_behind(parsed):
+  """
+  Returns whether a parsed regular expression uses any of LOOK_BEHIND or a
+  lookbehind assertion
+  """
+  for op, av in parsed:
+    if op == AT and av in LOOK_BEHIND:
+      return True
+    if op in (ASSERT, ASSERT_NOT) and av[0] < 0:
+      return True
+    if any(looks_behind(p) for p in subpatterns(av)):
+      return True
+  return False
+
+def subpatterns(av):
+  if isinstance(av, sre_parse.SubPattern):
+    yield av
+  elif isinstance(av, (tuple, list)):
+    for item in av:
+      for p in subpatterns(item):
+        yield p
+
+def key_pattern(pattern):
+  """
+  Returns a test of whether the compiled regular expression is found
+  within the key at block[start:end]. The pattern runs over the block in
+  place; a leading ^ is matched at the start of the key. Patterns that
+  otherwise look before where they start, with ^ elsewhere, \\b, \\B or a
+  lookbehind, are searched within a copy of the key instead.
+  """
+  parsed = sre_parse.parse(pattern.pattern, pattern.flags)
+  if not looks_behind(parsed):
+    search = pattern.search
+    return lambda block, start, end: search(block, start, end) is not None
+
+  leading = pattern.pattern.startswith('^') and parsed[0] == (AT, AT_BEGINNING)
+  if leading and not pattern.flags & re.MULTILINE:
+    rest = re.compile(pattern.pattern[1:], pattern.flags)
+    if not looks_behind(sre_parse.parse(rest.pattern, rest.flags)):
+      match = rest.match
+      return lambda block, start, end: match(block, start, end) is not None
+
+  search = pattern.search
+  return lambda block, start, end: search(block[start:end]) is not None
+
+
 class PBTreeDictReader(PBTreeReader):
-  def __init__(self, stream, item_keys, **options):
+  """
+  Reads values as records of the given item_keys. By default each record is
+  a dictionary, record can also be
+
+    'tuple'      a plain tuple of the values in item_keys order
+    'namedtuple' a namedtuple with a field per item key
+    'lazy'       a LazyRecord, which only unpacks a field when it is used
+
+  all of which take a fraction of the memory of a dictionary.
+  """
+
+  def __init__(self, stream, item_keys, record='dict', **options):
     self.item_keys = item_keys
     super(PBTreeDictReader, self).__init__(stream, **options)
+
+    if record == 'dict':
+      self.parse_value = self.parse_dict
+    elif record == 'tuple':
+      self.parse_value = self.parse_tuple
+    elif record == 'namedtuple':
+      self.record_type = namedtuple('Record', item_keys)
+      self.parse_value = self.parse_namedtuple
+    elif record == 'lazy':
+      self.parse_value = LazyRecord.type_for(item_keys, self.value_format)
+    else:
+      raise ValueError("unknown record type %r" % record)
     
-  def parse_value(self, bytes):
+  def value_fields(self):
+    return dict(zip(self.item_keys, field_layout(self.value_format)))
+
+  def parse_dict(self, bytes):
     """
     Returns a dictionary
     """
@@ -316,6 +782,96 @@ class PBTreeDictReader(PBTreeReader):
       self.item_keys,
       struct.unpack(self.value_format,bytes)
     ))
+
+  def parse_tuple(self, bytes):
+    return struct.unpack(self.value_format, bytes)
+
+  def parse_namedtuple(self, bytes):
+    return self.record_type._make(struct.unpack(self.value_format, bytes))
+
+
+class LazyRecord(object):
+  """
+  Read only, dictionary like record over the packed bytes of a value. Each
+  field is unpacked when it is accessed.
+
+  Use type_for() to create the record type for a set of item keys, the
+  instances only hold the packed bytes.
+  """
+  __slots__ = ('bytes',)
+
+  item_keys = ()
+  layout = {}
+
+  @classmethod
+  def type_for(cls, item_keys, value_format):
+    return type('LazyRecord', (cls,), dict(
+      __slots__=(),
+      item_keys=tuple(item_keys),
+      layout=dict(zip(item_keys, field_layout(value_format)))
+    ))
+
+  def __init__(self, bytes):
+    self.bytes = bytes
+
+  def __getitem__(self, key):
+    format, offset = self.layout[key]
+    return struct.unpack_from(format, self.bytes, offset)[0]
+
+  def get(self, key, default=None):
+    if key in self.layout:
+      return self[key]
+    return default
+
+  def keys(self):
+    return list(self.item_keys)
+
+  def __iter__(self):
+    return iter(self.item_keys)
+
+  def __len__(self):
+    return len(self.item_keys)
+
+  def __contains__(self, key):
+    return key in self.layout
+
+  def items(self):
+    return [(key, self[key]) for key in self.item_keys]
+
+  def values(self):
+    return [self[key] for key in self.item_keys]
+
+  def __eq__(self, other):
+    return dict(self.items()) == other
+
+  def __ne__(self, other):
+    return not self == other
+
+  def __repr__(self):
+    return repr(dict(self.items()))
+
+
+def field_layout(value_format):
+  """
+  Returns a (format, offset) pair for each field of a struct format, so
+  fields can be unpacked individually with struct.unpack_from(). Only
+  formats of single character codes, optionally with a byte order, are
+  supported. Native formats, without a byte order or with '@', include the
+  padding that aligns each field.
+  """
+  order = ''
+  codes = value_format
+  if codes and codes[0] in '@=<>!':
+    order, codes = codes[0], codes[1:]
+
+  if not codes.isalpha() or 's' in codes or 'p' in codes:
+    raise ValueError("unsupported value format %r" % value_format)
+
+  # a field ends where the format up to and including it does
+  return [
+    (order + code, struct.calcsize(order + codes[:i + 1]) - struct.calcsize(order + code))
+    for i, code in enumerate(codes)
+  ]
     
 ####
 # Lower level constructs whose functionality has been seperated out to make
@@ -383,9 +939,10 @@ class DataWriter(object):
     return self.stream.read(bytes)
   
 class IndexWriter(object):
-  def __init__(self, stream,  block_size, terminator, pointer_format='<I'):
+  def __init__(self, stream,  block_size, terminator, pointer_format='<I', data_block_size=None):
     self.stream = stream
     self.block_size = block_size
+    self.data_block_size = data_block_size or block_size
     self.terminator = terminator
     self.term_size = len(terminator)
     
@@ -439,10 +996,16 @@ class IndexWriter(object):
     out = self.stream
     blocks_written = 0
     
-    out.write(struct.pack(OFFSET_FMT, self.block_size))
-    
-    # blocks in the index
-    out.write(struct.pack(OFFSET_FMT, 0))
+    if self.data_block_size == self.block_size:
+      # readable by readers predating separate data block sizes
+      header_fmt = HEADER_FMT
+      header = [self.block_size]
+    else:
+      header_fmt = HEADER_V2_FMT
+      header = [0, FORMAT_VERSION, self.block_size, self.data_block_size]
+
+    # blocks in the index are filled in once written
+    out.write(struct.pack(header_fmt, *(header + [0])))
         
     
     for stream, pointers, remaining in reversed(self.indexes):
@@ -467,7 +1030,7 @@ class IndexWriter(object):
       blocks_written += blocks_to_write
       stream.close()
     
-    out.seek(OFFSET_SIZE)
+    out.seek(struct.calcsize(header_fmt) - OFFSET_SIZE)
     out.write(struct.pack(OFFSET_FMT, blocks_written))
     out.seek(0,2) # move to the end of the file  
 
@@ -486,27 +1049,41 @@ class DataBlockReader(object):
     
   def __iter__(self):
     block = self.bytes
+    value_size = self.value_size
+    for start, end in self.positions():
+      yield block[start:end], block[end+1:end+1+value_size]
+
+  def keys(self):
+    """
+    Iterates over the keys in the block without copying any values
+    """
+    block = self.bytes
+    for start, end in self.positions():
+      yield block[start:end]
+
+  def positions(self):
+    """
+    Yields (start, end) of every key in the block, the key's value follows
+    the terminator at end
+    """
+    block = self.bytes
+    terminator = self.terminator
+    step = 1 + self.value_size
     start = 0
     while True:
-      pos = block.find(self.terminator, start)
-      if pos == -1:
-        break
-      key = block[start:pos]
-      start=pos+1
-
-      if key == '':
+      pos = block.find(terminator, start)
+      if pos == -1 or pos == start:
+        # end of the block or the padding at the end of the block
         return
-      else:
-        value = block[start:start+self.value_size]
-        start+=self.value_size
-
-        yield key, value
+      yield start, pos
+      start = pos + step
 
   
 
 class IndexBlockReader(object):
   def __init__(self, data):
     self.data = data
+    self.parsed = None
 
 
   def __iter__(self):
@@ -529,15 +1106,18 @@ class IndexBlockReader(object):
       yield offset, key
   
   def find(self, key):
-    pointers = []
-    prefixes = []
-    for pointer, prefix in self:
-      pointers.append(pointer)
-      prefixes.append(prefix)
-      
-    # discard padding
-    prefixes.pop()
-    
+    if self.parsed is None:
+      pointers = []
+      prefixes = []
+      for pointer, prefix in self:
+        pointers.append(pointer)
+        prefixes.append(prefix)
+
+      # discard padding
+      prefixes.pop()
+      self.parsed = pointers, prefixes
+
+    pointers, prefixes = self.parsed
     index = bisect.bisect(prefixes, key)
     return pointers[index]
         
@@ -45,3 +45,14 @@ def signifigant(s1,s2):
   """  
   cl = commonlen(s1,s2)
   return s2[:cl+1]
+
+def successor(prefix):
+  """
+  Returns the smallest string greater than every string that starts with
+  prefix, or None if there is no such string (prefix is empty or all
+  '\xff' characters)
+  """
+  prefix = prefix.rstrip('\xff')
+  if not prefix:
+    return None
+  return prefix[:-1] + chr(ord(prefix[-1]) + 1)
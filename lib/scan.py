@@ -0,0 +1,75 @@
+# Copyright [2012] [Triv.io, Scott Robertson]
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+import mmap
+from multiprocessing import Pool, cpu_count
+
+from .pbtree import PBTreeReader
+
+
+def open_reader(path, reader, options):
+  stream = open(path, 'rb')
+  return reader(mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ), **options)
+
+
+def scan(path, mapper, reducer, reader=PBTreeReader, processes=None, chunks_per_process=4, **options):
+  """
+  Runs mapper over every data block of the pbtree at path in a pool of
+  processes and combines the results with reducer.
+
+  mapper(items) is called with the list of (key, value) items of one data
+  block and returns a partial result, reducer(a, b) combines two partial
+  results. reader is the PBTreeReader class used to decode the blocks,
+  options are passed on to it. All three must be picklable, i.e. defined
+  at the top level of a module.
+
+  Returns the reduced result, or None for a pbtree without data blocks.
+  Partial results are always combined in block order.
+  """
+  index = open_reader(path, reader, options)
+  start = index.index_block_size
+  end = index.last_data_block() + 1
+  if not index.data_block(start):
+    return None
+
+  processes = processes or cpu_count()
+  chunks = processes * chunks_per_process
+  step = max(1, (end - start + chunks - 1) / chunks)
+
+  tasks = [
+    (path, reader, options, mapper, reducer, first, min(first + step, end))
+    for first in range(start, end, step)
+  ]
+
+  pool = Pool(processes)
+  try:
+    return reduce(reducer, pool.imap(scan_chunk, tasks))
+  finally:
+    pool.terminate()
+    pool.join()
+
+
+def scan_chunk(task):
+  """
+  Runs in the worker processes, maps and reduces the blocks in [first, end)
+  """
+  path, reader, options, mapper, reducer, first, end = task
+  index = open_reader(path, reader, options)
+
+  result = None
+  for block_number in range(first, end):
+    partial = mapper(list(index.dataiter(index.data_block(block_number))))
+    result = partial if block_number == first else reducer(result, partial)
+  return result
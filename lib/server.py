@@ -0,0 +1,163 @@
+# Copyright [2012] [Triv.io, Scott Robertson]
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+"""
+A long running lookup server over a unix socket.
+
+The protocol is line based, every request is a single line of JSON, either
+one query or a list of queries answered in order. A query is
+
+  {"id": <anything>, "prefix": "com.example", "limit": 100}
+
+for every item starting with prefix (limit is optional), or
+
+  {"id": <anything>, "key": "com.example/:http"}
+
+for the item with exactly that key. Every matching item is sent back as
+a line
+
+  {"id": <id>, "key": <key>, "value": <value>}
+
+followed by {"id": <id>, "done": true, "count": <items sent>} once the
+query is complete, or {"id": <id>, "error": <message>} if it failed.
+"""
+
+import errno
+import json
+import os
+import socket
+import stat
+import SocketServer
+from itertools import islice
+
+from .shard import encode_key, decode_key
+
+
+class LookupHandler(SocketServer.StreamRequestHandler):
+  # buffer responses, they're flushed after every request
+  wbufsize = -1
+
+  def handle(self):
+    while True:
+      line = self.rfile.readline()
+      if not line:
+        break
+
+      try:
+        request = json.loads(line)
+      except ValueError, e:
+        self.send(dict(id=None, error='invalid request: %s' % e))
+        self.wfile.flush()
+        continue
+
+      queries = request if isinstance(request, list) else [request]
+      for query in queries:
+        self.answer(query)
+      self.wfile.flush()
+
+  def answer(self, query):
+    query_id = query.get('id') if isinstance(query, dict) else None
+    try:
+      count = 0
+      for key, value in self.server.lookup(query):
+        self.send(dict(id=query_id, key=encode_key(key), value=value))
+        count += 1
+      self.send(dict(id=query_id, done=True, count=count))
+    except socket.error:
+      raise
+    except Exception, e:
+      self.send(dict(id=query_id, error=str(e)))
+
+  def send(self, obj):
+    self.wfile.write(json.dumps(obj))
+    self.wfile.write('\n')
+
+
+class LookupServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+  """
+  Answers queries for the given reader on a unix socket at path. The
+  reader stays open for the life of the server so its index blocks, and
+  whatever blocks its mmap object caches, stay warm between queries.
+
+  Each connection is handled by a thread of its own, so the reader's mmap
+  object must be safe to read from several threads. A socket left at path
+  by an earlier server is replaced, a ValueError is raised if a server is
+  still listening on it.
+  """
+
+  daemon_threads = True
+
+  def __init__(self, path, reader):
+    self.reader = reader
+    if os.path.exists(path):
+      # left behind by an earlier server, anything else is not ours to remove
+      if not stat.S_ISSOCK(os.stat(path).st_mode):
+        raise ValueError("%s exists and is not a socket" % path)
+      if listening(path):
+        raise ValueError("a server is already listening on %s" % path)
+      os.unlink(path)
+    SocketServer.UnixStreamServer.__init__(self, path, LookupHandler)
+
+  def lookup(self, query):
+    if 'key' in query:
+      key = decode_key(query['key'])
+      value = self.reader.get(key)
+      return [] if value is None else [(key, value)]
+
+    items = self.reader.itemsiter(decode_key(query.get('prefix', '')))
+    if query.get('limit') is not None:
+      items = islice(items, query['limit'])
+    return items
+
+
+def listening(path):
+  """
+  Returns whether anything accepts connections on the unix socket at path
+  """
+  sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  try:
+    sock.connect(path)
+  except socket.error, e:
+    if e.errno in (errno.ECONNREFUSED, errno.ENOENT):
+      return False
+    raise
+  finally:
+    sock.close()
+  return True
+
+
+def query(path, queries):
+  """
+  Sends the queries to the server listening at path as a single batch and
+  yields (id, key, value) for every item returned.
+  """
+  sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  sock.connect(path)
+  try:
+    stream = sock.makefile('rwb')
+    stream.write(json.dumps(queries) + '\n')
+    stream.flush()
+
+    remaining = len(queries)
+    while remaining:
+      response = json.loads(stream.readline())
+      if 'error' in response:
+        raise ValueError(response['error'])
+      elif response.get('done'):
+        remaining -= 1
+      else:
+        yield response['id'], decode_key(response['key']), response['value']
+  finally:
+    sock.close()
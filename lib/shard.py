@@ -0,0 +1,226 @@
+# Copyright [2012] [Triv.io, Scott Robertson]
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+import bisect
+import json
+import threading
+from Queue import Queue, Full
+
+from .prefix import successor
+
+MANIFEST_VERSION = 1
+
+# keys are arbitrary bytes, json only handles unicode
+def encode_key(key):
+  return key.decode('latin-1')
+
+def decode_key(key):
+  return key.encode('latin-1')
+
+
+class ShardedWriter(object):
+  """
+  Splits sorted items across several pbtrees on key range boundaries and
+  records the range and geometry of each in a manifest.
+
+  Shard i holds the keys in [boundaries[i-1], boundaries[i]), the first
+  shard holds every key before boundaries[0] and the last every key from
+  boundaries[-1] on. Shards that would be empty are not written.
+  """
+
+  def __init__(self, open_stream, boundaries, writer, manifest, name='shard-%05d'):
+    """
+    open_stream(name) returns the stream a shard is written to, writer(stream)
+    returns a PBTreeWriter for it and the manifest is written to the given
+    stream on close().
+    """
+    self.open_stream = open_stream
+    self.boundaries = sorted(boundaries)
+    self.writer = writer
+    self.manifest = manifest
+    self.name = name
+
+    self.shards = []
+    self.current = None
+    self.shard_number = None
+
+  def add(self, key, value):
+    shard_number = bisect.bisect(self.boundaries, key)
+    if shard_number != self.shard_number:
+      self.close_shard()
+      self.open_shard(shard_number, key)
+
+    self.current.add(key, value)
+    self.shard['last_key'] = key
+    self.shard['items'] += 1
+
+  def open_shard(self, shard_number, key):
+    name = self.name % shard_number
+    self.shard_number = shard_number
+    self.current = self.writer(self.open_stream(name))
+    self.shard = dict(name=name, first_key=key, last_key=key, items=0)
+
+  def close_shard(self):
+    if self.current is None:
+      return
+    self.current.close()
+    self.shard['block_size'] = self.current.block_size
+    self.shard['data_block_size'] = self.current.data_block_size
+    self.shard['index_blocks'] = self.current.index_segment.blocks_written
+    self.shards.append(self.shard)
+    self.current = None
+
+  def close(self):
+    self.close_shard()
+    write_manifest(self.manifest, self.shards)
+    self.manifest.close()
+
+
+def write_manifest(stream, shards):
+  shards = [
+    dict(shard, first_key=encode_key(shard['first_key']), last_key=encode_key(shard['last_key']))
+    for shard in shards
+  ]
+  json.dump(dict(version=MANIFEST_VERSION, shards=shards), stream, indent=2, sort_keys=True)
+
+def read_manifest(stream):
+  manifest = json.load(stream)
+  if manifest['version'] != MANIFEST_VERSION:
+    raise ValueError("unsupported manifest version %r" % manifest['version'])
+
+  shards = []
+  for shard in manifest['shards']:
+    shard = dict((str(k), v) for k, v in shard.items())
+    shard['name'] = str(shard['name'])
+    shard['first_key'] = decode_key(shard['first_key'])
+    shard['last_key'] = decode_key(shard['last_key'])
+    shards.append(shard)
+  return shards
+
+
+class ShardedReader(object):
+  """
+  Reads the shards listed in a manifest as if they were a single pbtree.
+
+  Queries are only routed to the shards whose key range overlaps the
+  prefix. When several shards are involved each is scanned in a thread of
+  its own, at most buffer_size items ahead of the caller, and the results
+  are returned in key order.
+  """
+
+  def __init__(self, shards, open_reader, buffer_size=1024):
+    """
+    shards is the list returned by read_manifest() and open_reader(shard)
+    returns a PBTreeReader for one of its entries.
+    """
+    self.shards = shards
+    self.open_reader = open_reader
+    self.buffer_size = buffer_size
+    self.readers = {}
+
+  def reader(self, shard):
+    name = shard['name']
+    if name not in self.readers:
+      self.readers[name] = self.open_reader(shard)
+    return self.readers[name]
+
+  def shards_for(self, prefix):
+    """
+    Returns the shards that may contain keys starting with prefix.
+    """
+    end = successor(prefix)
+    return [
+      shard for shard in self.shards
+      if shard['last_key'] >= prefix and (end is None or shard['first_key'] < end)
+    ]
+
+  def keys(self, prefix='', key_filter=None, value_filter=None):
+    return list(self.keyiter(prefix, key_filter, value_filter))
+
+  def keyiter(self, prefix='', key_filter=None, value_filter=None):
+    for key, value in self.itemsiter(prefix, key_filter, value_filter):
+      yield key
+
+  def values(self, prefix=''):
+    return list(self.valueiter(prefix))
+
+  def valueiter(self, prefix=''):
+    for key, value in self.itemsiter(prefix):
+      yield value
+
+  def items(self, prefix='', key_filter=None, value_filter=None):
+    return list(self.itemsiter(prefix, key_filter, value_filter))
+
+  def itemsiter(self, prefix='', key_filter=None, value_filter=None):
+    # the filters are applied by each shard's reader
+    streams = [
+      self.reader(shard).itemsiter(prefix, key_filter, value_filter)
+      for shard in self.shards_for(prefix)
+    ]
+    if len(streams) == 1:
+      return streams[0]
+    # shards are disjoint and ordered so concatenating them keeps key order
+    return parallel_chain(streams, self.buffer_size)
+
+
+END = object()
+
+def parallel_chain(iterables, buffer_size):
+  """
+  Like itertools.chain() but every iterable is consumed concurrently by a
+  thread of its own, buffering at most buffer_size items each.
+  """
+  stop = threading.Event()
+  queues = [Queue(buffer_size) for i in iterables]
+
+  def put(queue, item):
+    while not stop.is_set():
+      try:
+        queue.put(item, timeout=0.1)
+        return True
+      except Full:
+        pass
+    return False
+
+  def produce(iterable, queue):
+    try:
+      for item in iterable:
+        if not put(queue, (None, item)):
+          return
+      put(queue, (None, END))
+    except Exception, e:
+      put(queue, (e, None))
+
+  threads = [
+    threading.Thread(target=produce, args=args)
+    for args in zip(iterables, queues)
+  ]
+  for thread in threads:
+    thread.daemon = True
+    thread.start()
+
+  try:
+    for queue in queues:
+      while True:
+        error, item = queue.get()
+        if error is not None:
+          raise error
+        if item is END:
+          break
+        yield item
+  finally:
+    stop.set()
+    for thread in threads:
+      thread.join()
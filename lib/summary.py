@@ -0,0 +1,286 @@
+# Copyright [2012] [Triv.io, Scott Robertson]
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+import hashlib
+import math
+import struct
+from tempfile import SpooledTemporaryFile
+
+MB = 1024**2
+DISK_BLOCK_SIZE = 1024 * 4
+
+# <magic> <version> <sketch precision> <first data block> <block count>
+HEADER_FMT = '<4sHHII'
+HEADER_SIZE = struct.calcsize(HEADER_FMT)
+# followed, since version 2, by the names of the size and distinct functions
+NAMES_FMT = '<32s32s'
+HEADER_V2_SIZE = HEADER_SIZE + struct.calcsize(NAMES_FMT)
+MAGIC = 'PBTS'
+VERSION = 2
+
+# <item count> <sum of sizes> <key offset> <first key length> <last key length>
+# followed by the sketch registers
+RECORD_FMT = '<IQQII'
+RECORD_SIZE = struct.calcsize(RECORD_FMT)
+
+
+class HyperLogLog(object):
+  """
+  Estimates the number of distinct values added to it using 2**precision
+  one byte registers. Sketches with the same precision can be merged.
+  """
+
+  def __init__(self, precision=8, registers=None):
+    self.precision = precision
+    self.m = 1 << precision
+    if registers is None:
+      self.registers = bytearray(self.m)
+    else:
+      self.registers = bytearray(registers)
+
+  def add(self, value):
+    h = struct.unpack('<Q', hashlib.sha1(str(value)).digest()[:8])[0]
+    bits = 64 - self.precision
+    index = h >> bits
+    rank = bits - (h & ((1 << bits) - 1)).bit_length() + 1
+    if rank > self.registers[index]:
+      self.registers[index] = rank
+
+  def merge(self, other):
+    for i, rank in enumerate(other.registers):
+      if rank > self.registers[i]:
+        self.registers[i] = rank
+
+  def count(self):
+    m = self.m
+    if m >= 128:
+      alpha = 0.7213 / (1 + 1.079 / m)
+    else:
+      alpha = {16: 0.673, 32: 0.697, 64: 0.709}[m]
+
+    estimate = alpha * m * m / sum(2.0 ** -rank for rank in self.registers)
+    zeros = self.registers.count('\0')
+    if estimate <= 2.5 * m and zeros:
+      # small range correction, linear counting
+      estimate = m * math.log(float(m) / zeros)
+    return int(round(estimate))
+
+
+class BlockSummaryWriter(object):
+  """
+  Writes a sidecar file with one summary per data block of a pbtree: the
+  number of items, the sum of size(value), the first and last keys and a
+  HyperLogLog sketch of distinct(value).
+
+  Pass it as the summary option of a PBTreeWriter, which calls add() for
+  every item, new_block() whenever a data block is started and finish() on
+  commit.
+
+  The names of size and distinct are recorded so aggregate() can check it
+  is given the same functions, lib.arc has the ones used for the url index.
+  """
+
+  def __init__(self, stream, size=None, distinct=None, precision=8):
+    self.stream = stream
+    self.size = size
+    self.distinct = distinct
+    self.precision = precision
+
+    self.records = SpooledTemporaryFile(max_size=20*MB)
+    self.keys = SpooledTemporaryFile(max_size=20*MB)
+    self.key_offset = 0
+    self.block_count = 0
+    self.current = None
+
+  def add(self, key, value):
+    if self.current is None:
+      self.current = dict(
+        items=0, size=0, first_key=key, sketch=HyperLogLog(self.precision)
+      )
+
+    current = self.current
+    current['items'] += 1
+    current['last_key'] = key
+    if self.size:
+      current['size'] += self.size(value)
+    if self.distinct:
+      current['sketch'].add(self.distinct(value))
+
+  def new_block(self):
+    current = self.current
+    if current is None:
+      return
+
+    self.records.write(struct.pack(
+      RECORD_FMT,
+      current['items'],
+      current['size'],
+      self.key_offset,
+      len(current['first_key']),
+      len(current['last_key'])
+    ))
+    self.records.write(current['sketch'].registers)
+
+    self.keys.write(current['first_key'])
+    self.keys.write(current['last_key'])
+    self.key_offset += len(current['first_key']) + len(current['last_key'])
+
+    self.block_count += 1
+    self.current = None
+
+  def finish(self, first_block):
+    """
+    Writes the sidecar, first_block is the number of the first data block
+    """
+    self.new_block()
+
+    out = self.stream
+    out.write(struct.pack(HEADER_FMT, MAGIC, VERSION, self.precision, first_block, self.block_count))
+    out.write(struct.pack(NAMES_FMT, function_name(self.size), function_name(self.distinct)))
+    for segment in (self.records, self.keys):
+      segment.seek(0)
+      while True:
+        bytes = segment.read(DISK_BLOCK_SIZE)
+        if bytes == '':
+          break
+        out.write(bytes)
+      segment.close()
+
+
+class BlockSummaryReader(object):
+  """
+  Reads a sidecar written by BlockSummaryWriter from any mmap like object.
+  The summaries of a range of blocks are read with a single fetch.
+  """
+
+  def __init__(self, mmap):
+    self.mmap = mmap
+    header = self.fetch(0, HEADER_V2_SIZE)
+    magic, version, self.precision, self.first_block, self.block_count = struct.unpack_from(
+      HEADER_FMT, header
+    )
+    if magic != MAGIC or version not in (1, VERSION):
+      raise ValueError("not a pbtree summary")
+
+    if version == 1:
+      # written before the function names were recorded
+      self.header_size = HEADER_SIZE
+      self.size_name = self.distinct_name = None
+    else:
+      self.header_size = HEADER_V2_SIZE
+      self.size_name, self.distinct_name = [
+        name.rstrip('\0') for name in struct.unpack_from(NAMES_FMT, header, HEADER_SIZE)
+      ]
+
+    self.record_size = RECORD_SIZE + (1 << self.precision)
+    self.keys_offset = self.header_size + self.record_size * self.block_count
+
+  def fetch(self, start, end):
+    return self.mmap[start:end]
+
+  def summaries(self, first, last):
+    """
+    Returns the summaries of the data blocks numbered first through last,
+    as dictionaries of items, size and sketch.
+    """
+    first = max(first, self.first_block)
+    last = min(last, self.first_block + self.block_count - 1)
+    if last < first:
+      return []
+
+    start = self.header_size + (first - self.first_block) * self.record_size
+    data = self.fetch(start, start + (last - first + 1) * self.record_size)
+
+    summaries = []
+    for pos in range(0, len(data), self.record_size):
+      items, size, key_offset, first_len, last_len = struct.unpack(
+        RECORD_FMT, data[pos:pos+RECORD_SIZE]
+      )
+      summaries.append(dict(
+        block=first + len(summaries),
+        items=items,
+        size=size,
+        sketch=HyperLogLog(self.precision, data[pos+RECORD_SIZE:pos+self.record_size]),
+        key_offset=key_offset,
+        first_len=first_len,
+        last_len=last_len
+      ))
+    return summaries
+
+  def block_keys(self, summary):
+    """
+    Returns the first and last keys of the block the summary describes
+    """
+    start = self.keys_offset + summary['key_offset']
+    keys = self.fetch(start, start + summary['first_len'] + summary['last_len'])
+    return keys[:summary['first_len']], keys[summary['first_len']:]
+
+  def item_counts(self, first, last):
+    """
+    Returns a dictionary of the number of items in each block between first
+    and last, suitable as PBTreeReader.sample()'s block_weight via .get
+    """
+    return dict((s['block'], s['items']) for s in self.summaries(first, last))
+
+
+def aggregate(reader, summary, prefix, size=None, distinct=None):
+  """
+  Returns the number of items starting with prefix, the sum of size(value)
+  and a sketch of distinct(value) for them, as a dictionary.
+
+  Blocks entirely covered by the prefix are answered from the summary,
+  only the first and last blocks of the range are read from the pbtree.
+  size and distinct must be the functions the summary was written with,
+  a ValueError is raised if their names differ or if the summary covers
+  other data blocks than the reader's, such as the summary of a shard or
+  of the index before it was compacted.
+  """
+  for function, name in ((size, summary.size_name), (distinct, summary.distinct_name)):
+    if name is not None and function_name(function) != name:
+      raise ValueError("summary was written with %r, not %r" % (name, function_name(function)))
+
+  block_count = reader.last_data_block() - reader.index_block_size + 1
+  if (summary.first_block, summary.block_count) != (reader.index_block_size, block_count):
+    raise ValueError("summary covers %d data blocks from block %d, the index has %d from block %d" % (
+      summary.block_count, summary.first_block, block_count, reader.index_block_size
+    ))
+
+  first, last = reader.data_block_range(prefix)
+
+  result = dict(items=0, size=0, sketch=HyperLogLog(summary.precision))
+
+  def add_block(block_number):
+    for key, value in reader.dataiter(reader.data_block(block_number)):
+      if key.startswith(prefix):
+        result['items'] += 1
+        if size:
+          result['size'] += size(value)
+        if distinct:
+          result['sketch'].add(distinct(value))
+
+  add_block(first)
+  if last > first:
+    add_block(last)
+
+  for block in summary.summaries(first + 1, last - 1):
+    result['items'] += block['items']
+    result['size'] += block['size']
+    result['sketch'].merge(block['sketch'])
+
+  return result
+
+
+def function_name(function):
+  return function.__name__ if function else ''
@@ -0,0 +1,72 @@
+# Copyright [2012] [Triv.io, Scott Robertson]
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+from unittest import TestCase
+
+from nose.tools import eq_
+
+from .advisor import CountingMap, measure, advise
+from .test_pbtree import build
+
+QUERIES = ['key0%d' % i for i in range(10)]
+LOOKUPS = ['key%05d' % i for i in range(0, 20000, 997)]
+
+
+class TestAdvisor(TestCase):
+  def setUp(self):
+    self.source = build(['key%05d' % i for i in range(20000)], block_size=256)
+
+  def test_counting_map(self):
+    counter = CountingMap('0123456789')
+    eq_(counter[2:5], '234')
+    eq_(counter[8:20], '89')
+    eq_((counter.requests, counter.bytes), (2, 5))
+
+  def test_measure(self):
+    small = measure(self.source, QUERIES, 64, 64)
+    large = measure(self.source, QUERIES, 1024, 64)
+    assert large['levels'] < small['levels']
+    assert large['requests'] < small['requests']
+
+    # narrow lookups read less with small data blocks
+    narrow = measure(self.source, LOOKUPS, 1024, 64)
+    wide = measure(self.source, LOOKUPS, 1024, 4096)
+    assert wide['bytes'] > narrow['bytes']
+
+  def test_advise(self):
+    sizes = (64, 1024, 4096)
+    results = advise(self.source, QUERIES, sizes, latency=1, bandwidth=10**9)
+    eq_(len(results), 9)
+    eq_(results, sorted(results, key=lambda r: r['cost']))
+    eq_(results[0]['requests'], min(r['requests'] for r in results))
+
+    # when transfers dominate, small blocks win for narrow lookups
+    results = advise(self.source, LOOKUPS, sizes, latency=0, bandwidth=1)
+    eq_(results[0]['bytes'], min(r['bytes'] for r in results))
+    eq_(results[0]['data_block_size'], 64)
+
+  def test_no_queries(self):
+    self.assertRaises(ValueError, advise, self.source, [])
+
+  def test_no_items(self):
+    self.assertRaises(ValueError, advise, build([]), QUERIES)
+
+  def test_no_usable_sizes(self):
+    self.assertRaises(ValueError, advise, self.source, QUERIES, (8,))
+    self.assertRaises(ValueError, advise, self.source, QUERIES, ())
+
+  def test_skip_small_sizes(self):
+    results = advise(self.source, QUERIES, (16, 1024))
+    eq_([(r['block_size'], r['data_block_size']) for r in results], [(1024, 1024)])
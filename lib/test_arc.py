@@ -0,0 +1,99 @@
+# Copyright [2012] [Triv.io, Scott Robertson]
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+import os
+from unittest import TestCase
+from tempfile import mkdtemp
+from shutil import rmtree
+from gzip import GzipFile
+from cStringIO import StringIO
+
+from nose.tools import eq_
+
+from .arc import extract, write_shards
+
+
+def gzip_member(data):
+  buffer = StringIO()
+  member = GzipFile(fileobj=buffer, mode='wb')
+  member.write(data)
+  member.close()
+  return buffer.getvalue()
+
+
+class TestArc(TestCase):
+  def setUp(self):
+    self.root = mkdtemp()
+    self.hits = []
+
+    os.mkdir(os.path.join(self.root, '1'))
+    for partition in range(2):
+      path = os.path.join(self.root, '1', '2012_%d.arc.gz' % partition)
+      with open(path, 'wb') as stream:
+        for i in range(3):
+          offset = stream.tell()
+          member = gzip_member('record %d.%d\n' % (partition, i))
+          stream.write(member)
+          self.hits.append(('url%d.%d' % (partition, i), dict(
+            arcSourceSegmentId=1,
+            arcFileDate=2012,
+            arcFilePartition=partition,
+            arcFileOffset=offset,
+            compressedSize=len(member)
+          )))
+
+  def tearDown(self):
+    rmtree(self.root)
+
+  def test_extract(self):
+    # hits are read back in file and offset order
+    results = list(extract(reversed(self.hits), self.root, processes=2, batch_size=2))
+
+    eq_([url for url, info, record in results], [url for url, info in self.hits])
+    eq_(results[4][2], 'record 1.1\n')
+
+  def test_missing_arc_file(self):
+    hit = ('missing', dict(self.hits[0][1], arcFilePartition=9))
+    results = list(extract([hit, self.hits[0]], self.root, processes=1))
+
+    eq_([record for url, info, record in results], ['record 0.0\n', None])
+
+  def test_corrupt_record(self):
+    path = os.path.join(self.root, '1', '2012_0.arc.gz')
+    with open(path, 'r+b') as stream:
+      stream.seek(self.hits[1][1]['arcFileOffset'] + 10)
+      stream.write('corrupt')
+    # the last record runs past the end of the file
+    with open(path, 'r+b') as stream:
+      stream.truncate(self.hits[2][1]['arcFileOffset'] + 5)
+
+    results = list(extract(self.hits, self.root, processes=1))
+    eq_([record for url, info, record in results], [
+      'record 0.0\n', None, None,
+      'record 1.0\n', 'record 1.1\n', 'record 1.2\n'
+    ])
+
+  def test_empty_arc_file(self):
+    open(os.path.join(self.root, '1', '2012_0.arc.gz'), 'wb').close()
+    results = list(extract(self.hits, self.root, processes=1))
+    eq_([record for url, info, record in results], [None] * 3 + ['record 1.0\n', 'record 1.1\n', 'record 1.2\n'])
+
+  def test_write_shards(self):
+    out = os.path.join(self.root, 'out')
+    os.mkdir(out)
+
+    paths = write_shards(extract(self.hits, self.root, processes=1), out, shard_size=20)
+    eq_([os.path.basename(p) for p in paths], ['part-00000.arc', 'part-00001.arc', 'part-00002.arc'])
+    eq_(open(paths[0]).read(), 'record 0.0\nrecord 0.1\n')
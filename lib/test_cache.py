@@ -0,0 +1,96 @@
+# Copyright [2012] [Triv.io, Scott Robertson]
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+import os
+import time
+from unittest import TestCase
+from tempfile import mkdtemp
+from shutil import rmtree
+
+from nose.tools import eq_
+
+from .cache import BlockCache, CachedMap
+from .pbtree import PBTreeReader
+from .test_pbtree import build
+
+
+class CountingMap(object):
+  def __init__(self, data):
+    self.data = data
+    self.fetches = 0
+
+  def __getitem__(self, i):
+    self.fetches += 1
+    return self.data[i]
+
+
+class TestCache(TestCase):
+  def setUp(self):
+    self.dir = mkdtemp()
+
+  def tearDown(self):
+    rmtree(self.dir)
+
+  def test_get_put(self):
+    cache = BlockCache(self.dir)
+    eq_(cache.get('index', 0, 4), None)
+
+    cache.put('index', 0, 4, 'abcd')
+    eq_(cache.get('index', 0, 4)[:], 'abcd')
+    eq_(cache.get('other', 0, 4), None)
+
+    # another process sharing the directory
+    eq_(BlockCache(self.dir).get('index', 0, 4)[:], 'abcd')
+    eq_(BlockCache(self.dir).size, 4)
+
+  def test_evict(self):
+    cache = BlockCache(self.dir, max_size=30)
+    for i in range(3):
+      cache.put('index', i, i + 10, 'x' * 10)
+      # give each block a distinct modification time
+      os.utime(cache.path('index', i, i + 10), (i, i))
+
+    cache.get('index', 0, 10)
+    cache.put('index', 3, 13, 'x' * 10)
+
+    eq_([cache.get('index', i, i + 10) is not None for i in range(4)], [True, False, False, True])
+    eq_(cache.size, 20)
+
+  def test_shared_size(self):
+    # each process alone stays under the cap, together they don't
+    caches = [BlockCache(self.dir, max_size=30) for i in range(3)]
+    for i, cache in enumerate(caches):
+      cache.put('index', i, i + 10, 'x' * 10)
+      os.utime(cache.path('index', i, i + 10), (i, i))
+    eq_([cache.size for cache in caches], [30] * 3)
+
+    caches[0].put('index', 3, 13, 'x' * 10)
+    eq_(caches[1].size, 20)
+    eq_(sum(size for path, size, mtime in caches[2].entries()), 20)
+
+    # caching a block again replaces it
+    caches[1].put('index', 3, 13, 'x' * 10)
+    eq_(caches[2].size, 20)
+
+  def test_cached_reader(self):
+    source = CountingMap(build(['key%03d' % i for i in range(100)]).mmap)
+
+    reader = PBTreeReader(CachedMap(source, BlockCache(self.dir), 'index'))
+    eq_(len(reader.keys('key0')), 100)
+    fetches = source.fetches
+
+    reader = PBTreeReader(CachedMap(source, BlockCache(self.dir), 'index'))
+    eq_(reader.items('key05'), [('key05%d' % i, 50 + i) for i in range(10)])
+    eq_(source.fetches, fetches)
@@ -0,0 +1,123 @@
+# Copyright [2012] [Triv.io, Scott Robertson]
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+from unittest import TestCase
+from tempfile import NamedTemporaryFile
+import mmap
+import os
+
+from nose.tools import eq_
+
+from .pbtree import PBTreeWriter, PBTreeReader
+from .delta import DeltaWriter, Delta, MergedReader, compact
+
+
+def open_map(temp):
+  stream = open(temp.name, 'r+')
+  return mmap.mmap(stream.fileno(), 0)
+
+def write(items):
+  temp = NamedTemporaryFile()
+  writer = PBTreeWriter(open(temp.name, 'w+'), block_size=64)
+  for key, value in items:
+    writer.add(key, value)
+  writer.close()
+  return temp
+
+def write_delta(items, deleted):
+  temp_items = NamedTemporaryFile()
+  temp_tombstones = NamedTemporaryFile()
+
+  delta = DeltaWriter(
+    PBTreeWriter(open(temp_items.name, 'w+'), block_size=64),
+    open(temp_tombstones.name, 'w+')
+  )
+  for key, value in items:
+    delta.add(key, value)
+  for key in deleted:
+    delta.delete(key)
+  delta.close()
+
+  return temp_items, temp_tombstones
+
+
+class TestDelta(TestCase):
+  def setUp(self):
+    self.temps = []
+
+    base = self.keep(write(('key%03d' % i, i) for i in range(100)))
+
+    first = [self.keep(t) for t in write_delta(
+      [('key005', 500), ('key050a', 5000)],
+      ['key006', 'key010']
+    )]
+    second = [self.keep(t) for t in write_delta(
+      [('key006', 600), ('key010', 1000)],
+      ['key005', 'key050a']
+    )]
+
+    self.reader = MergedReader(
+      PBTreeReader(open_map(base)),
+      [
+        Delta(PBTreeReader(open_map(first[0])), open_map(first[1])),
+      ]
+    )
+    self.second = Delta(PBTreeReader(open_map(second[0])), open_map(second[1]))
+
+  def keep(self, temp):
+    self.temps.append(temp)
+    return temp
+
+  def test_tombstone_block_size(self):
+    items, tombstones = write_delta([], [])
+    # a header and one index block of the items' size
+    eq_(os.path.getsize(tombstones.name), 8 + 64)
+
+    tombstones = NamedTemporaryFile()
+    delta = DeltaWriter(PBTreeWriter(open(items.name, 'w+'), block_size=64), open(tombstones.name, 'w+'), block_size=32)
+    delta.close()
+    eq_(os.path.getsize(tombstones.name), 8 + 32)
+
+  def test_merged(self):
+    eq_(self.reader.items('key00'), [
+      ('key000', 0),
+      ('key001', 1),
+      ('key002', 2),
+      ('key003', 3),
+      ('key004', 4),
+      ('key005', 500),
+      ('key007', 7),
+      ('key008', 8),
+      ('key009', 9),
+    ])
+    eq_(self.reader.keys('key05'), ['key050', 'key050a'] + ['key05%d' % i for i in range(1, 10)])
+    eq_(len(self.reader.keys()), 99)
+
+  def test_newest_delta_wins(self):
+    self.reader.deltas.append(self.second)
+    eq_(self.reader.items('key00'), [('key00%d' % i, i) for i in range(5)] + [
+      ('key006', 600),
+      ('key007', 7),
+      ('key008', 8),
+      ('key009', 9),
+    ])
+    eq_(self.reader.values('key010'), [1000])
+    eq_(self.reader.keys('key050'), ['key050'])
+
+  def test_compact(self):
+    temp = self.keep(NamedTemporaryFile())
+    compact(self.reader, PBTreeWriter(open(temp.name, 'w+'), block_size=64))
+
+    eq_(PBTreeReader(open_map(temp)).items(''), self.reader.items())
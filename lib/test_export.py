@@ -0,0 +1,138 @@
+# Copyright [2012] [Triv.io, Scott Robertson]
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+import ast
+import json
+import mmap
+import os
+import struct
+from unittest import TestCase
+from tempfile import mkdtemp, TemporaryFile
+from shutil import rmtree
+
+from nose.tools import eq_
+
+from .export import export, npy_header, ColumnarWriter, NPY_MAGIC, NATIVE_ORDER
+from .pbtree import PBTreeDictWriter, PBTreeDictReader
+
+ITEM_KEYS = ('segment', 'offset', 'size')
+VALUE_FORMAT = '<QIH'
+FORMATS = {'u8': 'Q', 'u4': 'I', 'u2': 'H', 'u1': 'B'}
+
+
+def load(path):
+  """
+  Reads a .npy file the way numpy.load does, returns its header and values
+  """
+  with open(path, 'rb') as stream:
+    data = stream.read()
+
+  assert data.startswith(NPY_MAGIC)
+  header_size, = struct.unpack_from('<H', data, len(NPY_MAGIC))
+  start = len(NPY_MAGIC) + 2 + header_size
+  eq_(start % 64, 0)
+
+  header = ast.literal_eval(data[len(NPY_MAGIC) + 2:start])
+  order, kind = header['descr'][0], header['descr'][1:]
+  length, = header['shape']
+  format = ('<' if order == '|' else order) + FORMATS[kind] * length
+  return header, list(struct.unpack_from(format, data, start))
+
+
+class TestExport(TestCase):
+  def setUp(self):
+    self.dir = mkdtemp()
+    self.keys = ['com.example/%03d:http' % i for i in range(250)] + ['org.example/:http']
+
+    stream = TemporaryFile()
+    writer = PBTreeDictWriter(stream, item_keys=ITEM_KEYS, value_format=VALUE_FORMAT, block_size=256)
+    for i, key in enumerate(self.keys):
+      writer.add(key, {'segment': 1000 + i, 'offset': i * 7, 'size': i % 50})
+    writer.commit()
+    stream.flush()
+    self.reader = PBTreeDictReader(mmap.mmap(stream.fileno(), 0), item_keys=ITEM_KEYS, value_format=VALUE_FORMAT)
+
+  def tearDown(self):
+    rmtree(self.dir)
+
+  def test_npy_header(self):
+    for length in (0, 1, 10**12):
+      header = npy_header('<u8', length)
+      eq_(len(header) % 64, 0)
+      assert header.endswith('\n')
+
+  def test_descr(self):
+    def descrs(value_format):
+      writer = ColumnarWriter(self.dir, 'abc'[:len(value_format) - 1], value_format)
+      return [c['descr'] for c in writer.columns]
+
+    eq_(descrs('<QIB'), ['<u8', '<u4', '|u1'])
+    eq_(descrs('!qd'), ['>i8', '>f8'])
+    eq_(descrs('=lh'), [NATIVE_ORDER + 'i4', NATIVE_ORDER + 'i2'])
+    # native sizes
+    eq_(descrs('@lI'), [NATIVE_ORDER + 'i%d' % struct.calcsize('l'), NATIVE_ORDER + 'u4'])
+    self.assertRaises(ValueError, descrs, '<Qc')
+    self.assertRaises(ValueError, descrs, '<?Q')
+
+  def test_native_alignment(self):
+    writer = ColumnarWriter(self.dir, ('count', 'total'), '@IQ', row_group_size=3)
+    # the Q is aligned past the I, not packed right after it
+    start = struct.calcsize('@IQ') - struct.calcsize('@Q')
+    eq_([(c['start'], c['end']) for c in writer.columns], [(0, 4), (start, start + 8)])
+
+    for i in range(5):
+      writer.add('key%d' % i, struct.pack('@IQ', i, 2**40 + i))
+    writer.close()
+
+    counts, totals = [], []
+    for group in writer.row_groups:
+      path = os.path.join(self.dir, group['name'])
+      counts.extend(load(os.path.join(path, 'count.npy'))[1])
+      totals.extend(load(os.path.join(path, 'total.npy'))[1])
+    eq_(counts, range(5))
+    eq_(totals, [2**40 + i for i in range(5)])
+
+  def test_export(self):
+    row_groups = export(self.reader, self.dir, prefixes=['com.'], row_group_size=100)
+    eq_(row_groups, [
+      dict(name='part-00000', rows=100),
+      dict(name='part-00001', rows=100),
+      dict(name='part-00002', rows=50),
+    ])
+
+    with open(os.path.join(self.dir, 'manifest.json')) as stream:
+      manifest = json.load(stream)
+    eq_([f['descr'] for f in manifest['fields']], ['<u8', '<u4', '<u2'])
+
+    urls, segments, sizes = [], [], []
+    for group in row_groups:
+      path = os.path.join(self.dir, group['name'])
+      header, offsets = load(os.path.join(path, 'url_offsets.npy'))
+      eq_(header['shape'], (group['rows'] + 1,))
+      header, url_bytes = load(os.path.join(path, 'url_bytes.npy'))
+      url_bytes = ''.join(map(chr, url_bytes))
+      urls.extend(url_bytes[s:e] for s, e in zip(offsets, offsets[1:]))
+
+      segments.extend(load(os.path.join(path, 'segment.npy'))[1])
+      sizes.extend(load(os.path.join(path, 'size.npy'))[1])
+
+    eq_(urls, self.keys[:250])
+    eq_(segments, [1000 + i for i in range(250)])
+    eq_(sizes, [i % 50 for i in range(250)])
+
+  def test_row_group_bytes(self):
+    row_groups = export(self.reader, self.dir, row_group_bytes=1000)
+    # each url is 20 bytes
+    eq_([g['rows'] for g in row_groups], [50] * 5 + [1])
@@ -0,0 +1,99 @@
+# Copyright [2012] [Triv.io, Scott Robertson]
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+import os
+from unittest import TestCase
+from tempfile import mkdtemp
+from shutil import rmtree
+
+from nose.tools import eq_
+
+from .journal import work_units, Journal, JournalMismatch
+
+
+def records():
+  for i in range(10):
+    yield {'arcFile': 'arc%d' % (i / 4), 'arcFileOffset': i * 100, 'compressedSize': 100}
+
+def source(record):
+  return record['arcFile']
+
+
+class TestJournal(TestCase):
+  def setUp(self):
+    self.dir = mkdtemp()
+    self.path = os.path.join(self.dir, 'copy.journal')
+
+  def tearDown(self):
+    rmtree(self.dir)
+
+  def test_work_units(self):
+    units = work_units(records(), source, unit_size=300)
+    eq_([len(r) for u, r in units], [3, 3, 3, 1])
+
+    unit, _ = units[1]
+    eq_(unit, dict(
+      unit=1,
+      output='part-00001.gz',
+      first=['arc0', 300],
+      last=['arc1', 500],
+      records=3,
+      bytes=300
+    ))
+
+  def test_resume(self):
+    units = [u for u, r in work_units(records(), source, unit_size=300)]
+
+    journal = Journal(self.path, {'domains': 'com.example'})
+    journal.record(units[0])
+    journal.record(units[2])
+    journal.close()
+
+    journal = Journal(self.path, {'domains': 'com.example'})
+    eq_([journal.is_complete(u) for u in units], [True, False, True, False])
+
+  def test_truncated_entry(self):
+    units = [u for u, r in work_units(records(), source, unit_size=300)]
+
+    journal = Journal(self.path, {'domains': 'com.example'})
+    journal.record(units[0])
+    journal.stream.write('{"unit": 1, "outp')
+    journal.close()
+
+    journal = Journal(self.path, {'domains': 'com.example'})
+    journal.record(units[1])
+    journal.close()
+
+    journal = Journal(self.path, {'domains': 'com.example'})
+    eq_([journal.is_complete(u) for u in units], [True, True, False, False])
+
+  def test_mismatched_params(self):
+    Journal(self.path, {'domains': 'com.example'}).close()
+    self.assertRaises(JournalMismatch, Journal, self.path, {'domains': 'org.example'})
+
+  def test_empty_journal(self):
+    units = [u for u, r in work_units(records(), source, unit_size=300)]
+
+    for contents in ('', '{"domains": "com'):
+      with open(self.path, 'w') as stream:
+        stream.write(contents)
+
+      journal = Journal(self.path, {'domains': 'com.example'})
+      journal.record(units[0])
+      journal.close()
+
+      journal = Journal(self.path, {'domains': 'com.example'})
+      eq_([journal.is_complete(u) for u in units], [True, False, False, False])
+      journal.close()
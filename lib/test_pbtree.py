@@ -17,8 +17,50 @@ from unittest import TestCase
 
 from nose.tools import eq_
 
-from .pbtree import PBTreeWriter, PBTreeReader, IndexWriter
+from .pbtree import PBTreeWriter, PBTreeReader, IndexWriter, PBTreeDictWriter, PBTreeDictReader, DataBlockReader
+from .pbtree import HEADER_FMT, HEADER_V2_FMT, LazyRecord, field_layout, key_pattern
 from tempfile import TemporaryFile
+import mmap
+import re
+import struct
+
+
+def build(keys, block_size=128, writer=PBTreeWriter, reader=PBTreeReader, **options):
+  """
+  Returns a reader over a pbtree containing the given keys, the value
+  of each key is its position.
+  """
+  stream = TemporaryFile()
+  pbtree = writer(stream, block_size=block_size, **options)
+  for pos, key in enumerate(keys):
+    pbtree.add(key, pos)
+  pbtree.commit()
+  stream.flush()
+  return reader(mmap.mmap(stream.fileno(), 0))
+
+def count_fetches(reader):
+  """
+  Records the number of every data block the reader reads from now on,
+  returns the list they are appended to. del reader.data_block stops it.
+  """
+  fetched = []
+  data_block = reader.data_block
+  def counting_data_block(block_number):
+    fetched.append(block_number)
+    return data_block(block_number)
+  reader.data_block = counting_data_block
+  return fetched
+
+# reversed host keys, www.example1.com sorts between the path and scheme
+# only keys of example.com
+HOST_KEYS = sorted(
+  ['com.example/%03d:http' % i for i in range(50)] +
+  ['com.example.www/%03d:http' % i for i in range(50)] +
+  ['com.example.blog/%03d:http' % i for i in range(50)] +
+  ['com.example1/%03d:http' % i for i in range(50)] +
+  ['com.examplefoo/%03d:http' % i for i in range(50)] +
+  ['com.example:http', 'com.example.www:8080:http', 'org.example/:http']
+)
 
 class TestPBTree(TestCase):
   def test_btree_index(self):
@@ -57,4 +99,260 @@ class TestPBTree(TestCase):
     eq_(block_1, '\x03\x00\x00\x00b\x00\x04\x00\x00\x00')
     
     block_2 = packet[20:]
-    eq_(block_2, '\x04\x00\x00\x00c\x00\x05\x00\x00\x00')
\ No newline at end of file
+    eq_(block_2, '\x04\x00\x00\x00c\x00\x05\x00\x00\x00')
+
+
+class TestHosts(TestCase):
+  def test_hosts(self):
+    reader = build(HOST_KEYS)
+    eq_(reader.hosts(), [
+      'com.example.blog',
+      'com.example.www',
+      'com.example',
+      'com.example1',
+      'com.examplefoo',
+      'org.example'
+    ])
+    eq_(reader.hosts('com.example.'), ['com.example.blog', 'com.example.www'])
+    eq_(reader.hosts('net.'), [])
+
+  def test_hosts_skip_blocks(self):
+    reader = build(HOST_KEYS)
+    fetched = count_fetches(reader)
+
+    reader.hosts('com.')
+    del reader.data_block
+
+    total = len(list(reader.blockiter(reader.index_block_size)))
+    assert len(set(fetched)) < total / 4, (fetched, total)
+
+  def test_domain(self):
+    reader = build(HOST_KEYS)
+    eq_(reader.domain_hosts('com.example'), [
+      'com.example.blog',
+      'com.example.www',
+      'com.example',
+    ])
+
+    keys = [k for k, v in reader.domain_items('com.example')]
+    eq_(len(keys), 152)
+    assert 'com.example1/000:http' not in keys
+    assert 'com.example:http' in keys
+
+  def test_host_histogram(self):
+    reader = build(HOST_KEYS)
+    eq_(reader.host_histogram('com.example'), {
+      'com.example': 51,
+      'com.example.blog': 50,
+      'com.example.www': 51,
+      'com.example1': 50,
+      'com.examplefoo': 50,
+    })
+
+
+class TestSample(TestCase):
+  def test_sample(self):
+    keys = ['key%05d' % i for i in range(5000)]
+    reader = build(keys)
+
+    fetched = count_fetches(reader)
+
+    sample = reader.sample('key0', 20, seed=1)
+    eq_(len(sample), 20)
+    eq_(sample, sorted(set(sample)))
+    for key, value in sample:
+      eq_(keys[value], key)
+      assert key.startswith('key0')
+
+    first, last = reader.data_block_range('key0')
+    assert len(set(fetched)) <= 20 < last - first
+
+    eq_(reader.sample('key0', 20, seed=1), sample)
+
+  def test_sample_weighted(self):
+    reader = build(['key%05d' % i for i in range(5000)])
+    sample = reader.sample('key', 10, seed=2, block_weight=lambda b: 1)
+    eq_(len(sample), 10)
+
+  def test_sample_weights(self):
+    reader = build(['key%05d' % i for i in range(5000)])
+
+    # no usable weights, blocks are picked uniformly
+    eq_(len(reader.sample('key0', 10, seed=2, block_weight=lambda b: 0)), 10)
+    # weights missing for some blocks
+    eq_(len(reader.sample('key0', 10, seed=2, block_weight=lambda b: 5 if b % 2 else None)), 10)
+    self.assertRaises(ValueError, reader.sample, 'key0', 10, block_weight=lambda b: -1)
+
+  def test_sample_no_full_scan(self):
+    reader = build(['key%05d' % i for i in range(5000)])
+    reader.items = None
+    # every pick lands in the first block, once rejection gives up the
+    # items found are returned rather than reading the whole range
+    first, last = reader.data_block_range('key')
+    sample = reader.sample('key', 2000, seed=1, block_weight=lambda b: 1 if b == first else 0)
+    assert 0 < len(sample) < 2000
+
+  def test_sample_small_prefix(self):
+    reader = build(['key%05d' % i for i in range(5000)])
+    eq_([k for k, v in reader.sample('key0001', 20, seed=1)], ['key%05d' % i for i in range(10, 20)])
+    eq_(reader.sample('nokey', 20), [])
+
+  def test_data_block_range(self):
+    reader = build(['key%05d' % i for i in range(5000)])
+    first, last = reader.data_block_range('')
+    eq_(first, reader.index_block_size)
+    eq_(last, reader.index_block_size + len(list(reader.blockiter(first))) - 1)
+
+
+class TestGeometry(TestCase):
+  keys = ['key%05d' % i for i in range(2000)]
+
+  def test_same_block_sizes(self):
+    reader = build(self.keys, block_size=128)
+    eq_(reader.header_fmt, HEADER_FMT)
+    eq_(struct.unpack_from('<I', reader.mmap[:4])[0], 128)
+    eq_(reader.data_block_size, 128)
+
+  def test_data_block_size(self):
+    reader = build(self.keys, block_size=64, data_block_size=512)
+    eq_(reader.header_fmt, HEADER_V2_FMT)
+    eq_((reader.block_size, reader.data_block_size), (64, 512))
+
+    eq_(reader.items(), list(zip(self.keys, range(len(self.keys)))))
+    eq_(reader.keys('key0123'), ['key0123%d' % i for i in range(10)])
+    eq_(reader.get('key01999'), 1999)
+
+    first, last = reader.data_block_range('')
+    eq_(last - first + 1, len(list(reader.blockiter(first))))
+    for block_number in range(first, last + 1):
+      eq_(len(reader.data_block(block_number)), 512)
+    eq_(len(reader.mmap), reader.block_offset(last + 1))
+
+  def test_fewer_levels(self):
+    small = build(self.keys, block_size=64)
+    large = build(self.keys, block_size=512, data_block_size=64)
+    assert large.count_levels() < small.count_levels()
+    eq_(large.keys(), small.keys())
+
+
+class TestRecords(TestCase):
+  item_keys = ('segment', 'offset', 'size')
+  value_format = '<QIH'
+
+  def reader(self, record, value_format=None):
+    value_format = value_format or self.value_format
+    stream = TemporaryFile()
+    writer = PBTreeDictWriter(stream, item_keys=self.item_keys, value_format=value_format, block_size=128)
+    for i in range(100):
+      writer.add('key%03d' % i, {'segment': i, 'offset': i * 1000, 'size': i % 7})
+    writer.commit()
+    stream.flush()
+    return PBTreeDictReader(
+      mmap.mmap(stream.fileno(), 0),
+      item_keys=self.item_keys,
+      value_format=value_format,
+      record=record
+    )
+
+  def test_keys_only(self):
+    reader = self.reader('dict')
+    parsed = []
+    reader.parse_value = parsed.append
+    eq_(reader.keys('key05'), ['key05%d' % i for i in range(10)])
+    eq_(parsed, [])
+
+    block = reader.data_block(reader.index_block_size)
+    eq_(list(DataBlockReader(block, 14).keys()), [k for k, v in DataBlockReader(block, 14)])
+
+  def test_tuple(self):
+    eq_(self.reader('tuple').values('key012'), [(12, 12000, 5)])
+
+  def test_namedtuple(self):
+    value = self.reader('namedtuple').values('key012')[0]
+    eq_((value.segment, value.offset, value.size), (12, 12000, 5))
+    eq_(value._asdict(), {'segment': 12, 'offset': 12000, 'size': 5})
+
+  def test_lazy(self):
+    value = self.reader('lazy').values('key012')[0]
+    eq_(value['offset'], 12000)
+    eq_(value, {'segment': 12, 'offset': 12000, 'size': 5})
+    eq_('{segment}:{size}'.format(**value), '12:5')
+    eq_(self.reader('lazy').items('key0'), self.reader('dict').items('key0'))
+
+  def test_native_format(self):
+    # the Q of a native format is aligned, not packed after the I
+    eq_(field_layout('IQ'), [('I', 0), ('Q', struct.calcsize('IQ') - struct.calcsize('Q'))])
+    eq_(field_layout('<IQ'), [('<I', 0), ('<Q', 4)])
+    eq_(LazyRecord.type_for(('a', 'b'), 'IQ')(struct.pack('IQ', 1, 2))['b'], 2)
+
+    reader = self.reader('lazy', value_format='HQI')
+    eq_(reader.values('key012'), [{'segment': 12, 'offset': 12000, 'size': 5}])
+    eq_(reader.keys('key0', value_filter={'offset': 12000}), ['key012'])
+
+  def test_unknown_record(self):
+    self.assertRaises(ValueError, self.reader, 'list')
+
+  def test_key_filter(self):
+    reader = self.reader('dict')
+    eq_(reader.keys('key', key_filter='5'), [k for k in reader.keys() if '5' in k])
+    eq_(reader.keys('key0', key_filter=re.compile('[13]$')), ['key0%d%d' % (i, j) for i in range(10) for j in (1, 3)])
+    eq_(reader.keys('key09', key_filter=lambda key: key > 'key095'), ['key096', 'key097', 'key098', 'key099'])
+    eq_(reader.keys('key0', key_filter=re.compile('^key07')), ['key07%d' % i for i in range(10)])
+    eq_(reader.keys('key', key_filter=re.compile('^key07'), value_filter={'size': 0}), ['key070', 'key077'])
+    # the filter only applies to the key, not the bytes of its value
+    eq_(reader.keys('', key_filter='\0'), [])
+
+  def test_pattern_in_place(self):
+    class Block(str):
+      def __getslice__(self, i, j):
+        raise AssertionError("copied the key")
+    block = Block('xx\0key07\0yyyy')
+
+    for pattern in ('ey0', '^key', '7$', '(?i)KEY'):
+      eq_(key_pattern(re.compile(pattern))(block, 3, 8), True, pattern)
+    for pattern in ('^ey', 'yy'):
+      eq_(key_pattern(re.compile(pattern))(block, 3, 8), False, pattern)
+
+    # these look before the key so are searched within a copy of it
+    block = 'xx\0key07\0yyyy'
+    for pattern in ('zz|^key', '^key|zz', '(?i)^KEY', r'\Bey'):
+      eq_(key_pattern(re.compile(pattern))(block, 3, 8), True, pattern)
+    for pattern in ('(?<=x)key', '^ey|zz', r'\bey'):
+      eq_(key_pattern(re.compile(pattern))(block, 3, 8), False, pattern)
+    eq_(key_pattern(re.compile(r'\bkey'))('xxkey07\0', 2, 7), True)
+
+  def test_skip_blocks(self):
+    reader = self.reader('dict')
+    fetched = count_fetches(reader)
+
+    parsed = []
+    parse_value = reader.parse_value
+    def counting_parse_value(bytes):
+      parsed.append(bytes)
+      return parse_value(bytes)
+    reader.parse_value = counting_parse_value
+
+    eq_(reader.items('key', key_filter='key07'), [
+      ('key07%d' % i, {'segment': 70 + i, 'offset': (70 + i) * 1000, 'size': (70 + i) % 7})
+      for i in range(10)
+    ])
+    eq_(len(parsed), 10)
+
+    # blocks without a match are skipped, stopping once past the prefix
+    del fetched[:]
+    eq_(reader.keys('key03', key_filter='zzz'), [])
+    first, last = reader.data_block_range('key03')
+    eq_(fetched, range(first, last + 1))
+    assert last < reader.last_data_block()
+
+  def test_value_filter(self):
+    reader = self.reader('dict')
+    eq_(reader.keys('key', value_filter={'size': 3}), ['key%03d' % i for i in range(100) if i % 7 == 3])
+    eq_(reader.keys('key', value_filter={'size': set([0, 1]), 'segment': lambda s: s > 90}), ['key091', 'key092', 'key098', 'key099'])
+    eq_(reader.keys('key1', value_filter={'offset': 0}), [])
+    eq_(reader.keys('key0', value_filter=lambda value: value['segment'] == 42), ['key042'])
+    self.assertRaises(ValueError, reader.keys, 'key', value_filter={'nofield': 1})
+
+  def test_scalar_value_filter(self):
+    reader = build(['key%03d' % i for i in range(100)])
+    eq_(reader.items('key0', key_filter='5', value_filter={0: set([5, 15, 50])}), [('key005', 5), ('key015', 15), ('key050', 50)])
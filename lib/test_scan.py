@@ -0,0 +1,73 @@
+# Copyright [2012] [Triv.io, Scott Robertson]
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+from unittest import TestCase
+from tempfile import NamedTemporaryFile
+
+from nose.tools import eq_
+
+from . import keyhost
+from .pbtree import PBTreeWriter, PBTreeDictWriter, PBTreeDictReader
+from .scan import scan
+
+
+def count_and_sum(items):
+  return len(items), sum(value for key, value in items)
+
+def add_pairs(a, b):
+  return a[0] + b[0], a[1] + b[1]
+
+def size_per_tld(items):
+  sizes = {}
+  for key, value in items:
+    tld = keyhost(key)[0].split('.')[0]
+    sizes[tld] = sizes.get(tld, 0) + value['size']
+  return sizes
+
+def merge_sizes(a, b):
+  merged = dict(a)
+  for tld, size in b.items():
+    merged[tld] = merged.get(tld, 0) + size
+  return merged
+
+
+class TestScan(TestCase):
+  def test_scan(self):
+    temp = NamedTemporaryFile()
+    writer = PBTreeWriter(open(temp.name, 'w+'), block_size=64)
+    for i in range(1000):
+      writer.add('key%04d' % i, i)
+    writer.close()
+
+    eq_(scan(temp.name, count_and_sum, add_pairs, processes=3), (1000, sum(range(1000))))
+
+  def test_scan_dict(self):
+    temp = NamedTemporaryFile()
+    writer = PBTreeDictWriter(open(temp.name, 'w+'), item_keys=('size',), value_format='<I', block_size=128)
+    for tld in ('com', 'net', 'org'):
+      for i in range(100):
+        writer.add('%s.example/%03d:http' % (tld, i), {'size': 10})
+    writer.close()
+
+    result = scan(
+      temp.name, size_per_tld, merge_sizes,
+      reader=PBTreeDictReader, item_keys=('size',), value_format='<I'
+    )
+    eq_(result, {'com': 1000, 'net': 1000, 'org': 1000})
+
+  def test_empty(self):
+    temp = NamedTemporaryFile()
+    PBTreeWriter(open(temp.name, 'w+')).close()
+    eq_(scan(temp.name, count_and_sum, add_pairs), None)
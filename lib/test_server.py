@@ -0,0 +1,84 @@
+# Copyright [2012] [Triv.io, Scott Robertson]
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+import os
+import threading
+from unittest import TestCase
+from tempfile import mkdtemp
+from shutil import rmtree
+
+from nose.tools import eq_
+
+from .cache import MemoryCache, CachedMap
+from .pbtree import PBTreeReader
+from .server import LookupServer, query
+from .test_pbtree import build
+
+
+class TestServer(TestCase):
+  def setUp(self):
+    self.dir = mkdtemp()
+    self.path = os.path.join(self.dir, 'socket')
+
+    mmap = build(['key%03d' % i for i in range(200)] + ['key\xe9']).mmap
+    reader = PBTreeReader(CachedMap(mmap, MemoryCache(), 'index'), index_cache={})
+
+    self.server = LookupServer(self.path, reader)
+    self.thread = threading.Thread(target=self.server.serve_forever)
+    self.thread.start()
+
+  def tearDown(self):
+    self.server.shutdown()
+    self.server.server_close()
+    self.thread.join()
+    rmtree(self.dir)
+
+  def test_batch(self):
+    results = list(query(self.path, [
+      {'id': 1, 'prefix': 'key01'},
+      {'id': 2, 'key': 'key150'},
+      {'id': 3, 'key': 'key15'},
+      {'id': 4, 'prefix': 'key', 'limit': 3},
+      {'id': 5, 'prefix': 'key\xe9'.decode('latin-1')},
+    ]))
+
+    eq_(results,
+      [(1, 'key01%d' % i, 10 + i) for i in range(10)] +
+      [(2, 'key150', 150)] +
+      [(4, 'key00%d' % i, i) for i in range(3)] +
+      [(5, 'key\xe9', 200)]
+    )
+
+  def test_existing_path(self):
+    path = os.path.join(self.dir, 'data')
+    with open(path, 'w') as stream:
+      stream.write('data')
+    self.assertRaises(ValueError, LookupServer, path, self.server.reader)
+    eq_(open(path).read(), 'data')
+
+    # the socket of a running server is left alone
+    self.assertRaises(ValueError, LookupServer, self.path, self.server.reader)
+    eq_(len(list(query(self.path, [{'id': 1, 'prefix': 'key1'}]))), 100)
+
+    # a stale socket is replaced
+    server = LookupServer(self.path + '2', self.server.reader)
+    server.server_close()
+    server = LookupServer(self.path + '2', self.server.reader)
+    server.server_close()
+
+  def test_error(self):
+    self.assertRaises(ValueError, list, query(self.path, [{'id': 1, 'prefix': 'key', 'limit': 'x'}]))
+    # the server keeps answering after a failed query
+    eq_(len(list(query(self.path, [{'id': 1, 'prefix': 'key1'}]))), 100)
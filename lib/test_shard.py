@@ -0,0 +1,86 @@
+# Copyright [2012] [Triv.io, Scott Robertson]
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+import mmap
+import os
+from unittest import TestCase
+from tempfile import mkdtemp
+from shutil import rmtree
+from functools import partial
+
+from nose.tools import eq_
+
+from .pbtree import PBTreeWriter, PBTreeReader
+from .shard import ShardedWriter, ShardedReader, read_manifest
+
+KEYS = sorted(
+  ['com.example/%03d:http' % i for i in range(100)] +
+  ['net.example/%03d:http' % i for i in range(100)] +
+  ['org.example/%03d:http' % i for i in range(100)] +
+  ['org.example/\xe9:http']
+)
+
+
+class TestShard(TestCase):
+  def setUp(self):
+    self.dir = mkdtemp()
+
+    writer = ShardedWriter(
+      lambda name: open(os.path.join(self.dir, name), 'w+'),
+      ['net.', 'org.', 'uk.'],
+      partial(PBTreeWriter, block_size=128),
+      open(os.path.join(self.dir, 'manifest'), 'w')
+    )
+    for pos, key in enumerate(KEYS):
+      writer.add(key, pos)
+    writer.close()
+
+    self.shards = read_manifest(open(os.path.join(self.dir, 'manifest')))
+    self.opened = []
+    self.reader = ShardedReader(self.shards, self.open_reader, buffer_size=8)
+
+  def tearDown(self):
+    rmtree(self.dir)
+
+  def open_reader(self, shard):
+    self.opened.append(shard['name'])
+    stream = open(os.path.join(self.dir, shard['name']), 'r+')
+    return PBTreeReader(mmap.mmap(stream.fileno(), 0))
+
+  def test_manifest(self):
+    eq_([s['name'] for s in self.shards], ['shard-00000', 'shard-00001', 'shard-00002'])
+    eq_(self.shards[2]['first_key'], 'org.example/000:http')
+    eq_(self.shards[2]['last_key'], 'org.example/\xe9:http')
+    eq_(self.shards[0]['items'], 100)
+    eq_(self.shards[0]['block_size'], 128)
+    eq_(self.shards[0]['data_block_size'], 128)
+
+  def test_routing(self):
+    eq_(len(self.reader.keys('net.example/01')), 10)
+    eq_(self.opened, ['shard-00001'])
+
+  def test_scan_all(self):
+    eq_(self.reader.items(), list(zip(KEYS, range(len(KEYS)))))
+    eq_(sorted(self.opened), ['shard-00000', 'shard-00001', 'shard-00002'])
+
+  def test_filters(self):
+    eq_(self.reader.keys('', key_filter='/05', value_filter={0: set([50, 150, 250, 199])}), [
+      'com.example/050:http', 'net.example/050:http', 'org.example/050:http'
+    ])
+
+  def test_stop_early(self):
+    keys = self.reader.keyiter()
+    eq_(keys.next(), KEYS[0])
+    keys.close()
@@ -0,0 +1,122 @@
+# Copyright [2012] [Triv.io, Scott Robertson]
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+import mmap
+import struct
+from unittest import TestCase
+from tempfile import TemporaryFile
+
+from nose.tools import eq_
+
+from .pbtree import PBTreeDictWriter, PBTreeDictReader
+from .summary import HyperLogLog, BlockSummaryWriter, BlockSummaryReader, aggregate
+from .summary import HEADER_FMT, HEADER_V2_SIZE
+from .test_pbtree import count_fetches
+
+ITEM_KEYS = ('arcFile', 'compressedSize')
+VALUE_FORMAT = '<II'
+
+def size(value):
+  return value['compressedSize']
+
+def arc_file(value):
+  return value['arcFile']
+
+def open_map(stream):
+  stream.flush()
+  return mmap.mmap(stream.fileno(), 0)
+
+
+def write(keys):
+  """
+  Returns a reader over an index of the keys and its summary sidecar
+  """
+  index = TemporaryFile()
+  sidecar = TemporaryFile()
+  writer = PBTreeDictWriter(
+    index,
+    item_keys=ITEM_KEYS,
+    value_format=VALUE_FORMAT,
+    block_size=256,
+    summary=BlockSummaryWriter(sidecar, size=size, distinct=arc_file)
+  )
+  for pos, key in enumerate(keys):
+    writer.add(key, {'arcFile': pos / 10, 'compressedSize': pos})
+  writer.commit()
+
+  reader = PBTreeDictReader(open_map(index), item_keys=ITEM_KEYS, value_format=VALUE_FORMAT)
+  return reader, open_map(sidecar)
+
+
+class TestSummary(TestCase):
+  def setUp(self):
+    self.keys = ['com.example%d/%03d:http' % (host, i) for host in range(5) for i in range(200)]
+    self.reader, self.sidecar = write(self.keys)
+    self.summary = BlockSummaryReader(self.sidecar)
+
+  def test_summaries(self):
+    first, last = self.reader.data_block_range('')
+    summaries = self.summary.summaries(first, last)
+
+    eq_(len(summaries), last - first + 1)
+    for s in summaries:
+      items = list(self.reader.dataiter(self.reader.data_block(s['block'])))
+      eq_(s['items'], len(items))
+      eq_(s['size'], sum(v['compressedSize'] for k, v in items))
+      eq_(self.summary.block_keys(s), (items[0][0], items[-1][0]))
+
+  def test_aggregate(self):
+    fetched = count_fetches(self.reader)
+
+    result = aggregate(self.reader, self.summary, 'com.example2', size=size, distinct=arc_file)
+
+    eq_(result['items'], 200)
+    eq_(result['size'], sum(range(400, 600)))
+    assert abs(result['sketch'].count() - 20) <= 2
+    eq_(len(fetched), 2)
+
+  def test_functions(self):
+    eq_((self.summary.size_name, self.summary.distinct_name), ('size', 'arc_file'))
+    self.assertRaises(ValueError, aggregate, self.reader, self.summary, 'com.', size=size, distinct=str)
+    self.assertRaises(ValueError, aggregate, self.reader, self.summary, 'com.')
+
+  def test_other_index(self):
+    # the summary of a shard, or of the index before more urls were added
+    shard, sidecar = write(self.keys[:400])
+    self.assertRaises(ValueError, aggregate, self.reader, BlockSummaryReader(sidecar), 'com.', size=size, distinct=arc_file)
+    self.assertRaises(ValueError, aggregate, shard, self.summary, 'com.', size=size, distinct=arc_file)
+
+    grown, sidecar = write(self.keys + ['org.example/%05d:http' % i for i in range(5000)])
+    assert grown.index_block_size > self.reader.index_block_size
+    self.assertRaises(ValueError, aggregate, grown, self.summary, 'com.', size=size, distinct=arc_file)
+
+  def test_version_1(self):
+    header = list(struct.unpack_from(HEADER_FMT, self.sidecar))
+    header[1] = 1
+    summary = BlockSummaryReader(struct.pack(HEADER_FMT, *header) + self.sidecar[HEADER_V2_SIZE:])
+    eq_(summary.size_name, None)
+    for old, new in zip(summary.summaries(0, 100), self.summary.summaries(0, 100)):
+      eq_((old['items'], old['size'], old['sketch'].registers), (new['items'], new['size'], new['sketch'].registers))
+      eq_(summary.block_keys(old), self.summary.block_keys(new))
+    eq_(aggregate(self.reader, summary, 'com.example2')['items'], 200)
+
+  def test_hyperloglog(self):
+    a, b = HyperLogLog(10), HyperLogLog(10)
+    for i in range(5000):
+      a.add(i)
+    for i in range(2500, 10000):
+      b.add(i)
+    a.merge(b)
+    assert abs(a.count() - 10000) < 1000, a.count()